@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+valveBenchmark.py
+Times each stage of the valveData pipeline on its own against a local
+valveFakeServer, over a range of data sizes, so changes to any one stage
+can be measured offline.  Stages:
+    fetch        transfer of the raw response
+    parseJson    json to UTCDateTime/datenum/data lists
+    parseFast    json to numpy arrays (parseJson fast=True)
+    detectGap    gap indexes of the UTCDateTime list
+    splitData    gap splitting and resampling
+    data2obspy   obspy Stream of the split data
+--------------------------------------------------------------------
+Example:
+import valveBenchmark
+results = valveBenchmark.run(sizes=[1000, 10000], repeats=3)
+
+or from the command line:
+python valveBenchmark.py --sizes 1000 10000 100000 --latency 0.01
+"""
+import time
+import valveData
+import valveFakeServer
+
+stages = ('fetch', 'parseJson', 'parseFast', 'detectGap', 'splitData', 'data2obspy')
+
+def best(func, repeats):
+    '''
+    Returns (seconds, result) of the fastest of repeats calls to func.
+    '''
+    times = []
+    for i in range(repeats):
+        t0 = time.time()
+        result = func()
+        times.append(time.time() - t0)
+    return min(times), result
+
+def runSize(channel, npts, repeats=3, delta=60, gapThres=120):
+    '''
+    Times every stage for one rsam request of about npts samples.  Returns
+    a dict of seconds by stage, plus 'npts' and 'bytes' (received over the
+    wire).
+    '''
+    from datetime import datetime
+    end = 1429056000   # 2015-04-15
+    start = end - npts * delta
+    vtime = lambda t: datetime.utcfromtimestamp(t).strftime('%Y%m%d%H%M%S')
+    payload = {'channel': channel, 'starttime': vtime(start), 'endtime': vtime(end),
+               'timezone': 'utc', 'downsample': 'none', 'dsint': 1}
+    row = {}
+    row['fetch'], resp = best(lambda: valveData.client.get('rsam', params=payload), repeats)
+    row['bytes'] = valveData.wireBytes(resp)
+    row['parseJson'], (date, datenum, data) = best(lambda: valveData.parseJson(resp, channel, 'rsam'), repeats)
+    row['parseFast'], fast = best(lambda: valveData.parseJson(resp, channel, 'rsam', fast=True), repeats)
+    row['npts'] = len(data)
+    row['detectGap'], gapIndex = best(lambda: valveData.detectGap(date, gapThres), repeats)
+    row['splitData'], (slicedDates, slicedData) = best(
+        lambda: valveData.splitData(date, data, gapIndex, delta=delta, resample=True), repeats)
+    row['data2obspy'], stream = best(
+        lambda: valveData.data2obspy(slicedDates, slicedData, channel), repeats)
+    return row
+
+def run(sizes=(1000, 10000, 100000), repeats=3, gapRate=0.001, latency=0, channel='NPT$HWZ$HV'):
+    '''
+    Starts a FakeValveServer, points valveData at it and times every stage
+    at each size.
+
+    Parameters
+    ----------
+    sizes: list
+        approximate samples per request
+    repeats: int
+        calls per stage, the fastest is kept.  default is 3
+    gapRate: float
+        chance of each sample starting a gap (see FakeValveServer)
+    latency: float
+        seconds the server waits before each answer.  default is 0
+    channel: string
+        rsam channel to request
+
+    Outputs
+    ---------
+    results: list
+        one dict per size of seconds by stage, plus 'npts' and 'bytes'
+    '''
+    server = valveFakeServer.FakeValveServer(gapRate=gapRate, latency=latency).start()
+    old = valveData.client
+    valveData.client = valveData.ValveClient(host=server.host)
+    try:
+        return [runSize(channel, npts, repeats) for npts in sizes]
+    finally:
+        valveData.client.close()
+        valveData.client = old
+        server.stop()
+
+def report(results):
+    '''
+    Prints results of run() as a table of milliseconds per stage.
+    '''
+    print '%9s %11s ' % ('npts', 'bytes') + ' '.join('%10s' % s for s in stages)
+    for row in results:
+        print '%9d %11d ' % (row['npts'], row['bytes']) + ' '.join('%10.1f' % (row[s] * 1000) for s in stages)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark valveData stages against a fake Valve')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--gapRate', type=float, default=0.001)
+    parser.add_argument('--latency', type=float, default=0)
+    args = parser.parse_args()
+    report(run(args.sizes, args.repeats, args.gapRate, args.latency))
+
+if __name__ == "__main__":
+    main()
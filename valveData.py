@@ -2,12 +2,15 @@
 """
 valveData.py
 Library to extract data from valve using a REST interface.  Optionally, data
-can be detected for gaps, resampled and put into a obspy Stream structure.  REquires
-a parameter file called 'config.json' in the same directory as script.  Contents
+can be detected for gaps, resampled and put into a obspy Stream structure.  Settings
+are read on first use from the file named by the VALVEDATA_CONFIG environment
+variable, or a 'config.json' in the working directory or next to this module
+(see loadConfig), or the host can be passed to configureClient().  Contents
 should look something like this:
 {
   "host": "hvo-rest.wr.usgs.gov"
 }
+or "hosts": [...] to spread requests over replicated Valve servers.
 See requests documentation for more details.
 --------------------------------------------------------------------
 RSAM DATA Example:
@@ -27,17 +30,391 @@ Created on Mon Feb 16 07:50:24 2015
 """
 
 import json
+import time
+import socket
+import logging
+import asyncore
 import requests
 
+logger = logging.getLogger('valveData')
+
+# Settings from config.json, read on first use (see loadConfig)
 config = {}
+configPath = None
+configLoaded = False
+
+def loadConfig(path=None, merge=False):
+    '''
+    Reads a json settings file into config, replacing what was there, and
+    returns config.  With merge, keys already set in config (ex.
+    valveData.config['host'] = ... after import) are kept and the file only
+    fills in the others; settings() loads this way.  Without a path, the
+    file named by the VALVEDATA_CONFIG environment variable is used, then
+    config.json in the working directory, then config.json next to this
+    module.  If none of those exist config is left empty, and the host has
+    to be given to configureClient().  The client reads its settings at its
+    first request, so load before then or call configureClient() afterwards.
+    '''
+    import os
+    global configPath, configLoaded
+    if path is not None:
+        candidates = [path]
+    else:
+        candidates = [os.environ.get('VALVEDATA_CONFIG'), 'config.json',
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')]
+    for candidate in candidates:
+        if candidate and (path is not None or os.path.exists(candidate)):
+            with open(candidate) as cfg:
+                loaded = json.load(cfg)
+            if merge:
+                for key, value in loaded.items():
+                    config.setdefault(key, value)
+            else:
+                config.clear()
+                config.update(loaded)
+            configPath = candidate
+            break
+    else:
+        logger.debug('No config.json found, using defaults')
+    configLoaded = True
+    return config
+
+def settings():
+    '''
+    Returns config, merging in the file found by loadConfig() the first
+    time.
+    '''
+    if not configLoaded:
+        loadConfig(merge=True)
+    return config
+
 try:
-    with open('config.json') as cfg:
-        config = json.load(cfg)
-except:
-    with open('/Users/westonthelen/python/config.json') as cfg:
-        config = json.load(cfg)
-            
-    
+    from requests.packages.urllib3.util.retry import Retry
+except ImportError:
+    from urllib3.util.retry import Retry
+
+
+class HostStats(object):
+    '''
+    Request statistics and circuit breaker state of one Valve host, kept by
+    ValveClient.  latency is a moving average of seconds to the full
+    response (to the headers for stream=True requests).
+    '''
+    def __init__(self, host):
+        self.host = host
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0      # consecutive errors
+        self.latency = None
+        self.inflight = 0
+        self.openUntil = 0     # circuit is open (host skipped) until then
+
+    def score(self, now):
+        '''
+        Lower is better: expected latency scaled by requests already in
+        flight.  Hosts with an open circuit sort last.
+        '''
+        return (self.openUntil > now, (self.latency or 0.0) * (1 + self.inflight), self.inflight)
+
+    def summary(self):
+        return {'requests': self.requests, 'errors': self.errors, 'failures': self.failures,
+                'latency': self.latency, 'inflight': self.inflight,
+                'open': self.openUntil > time.time()}
+
+class ValveClient(object):
+    '''
+    Holds a pooled requests.Session that every fetch function goes through, so
+    a batch of requests reuses open sockets instead of opening a new TCP
+    connection for each call.  The session is built on the first request;
+    settings not given here are then read from config.json ('hosts' or
+    'host', 'poolSize', 'retries', 'backoff', 'timeout', 'breakerFailures',
+    'breakerReset'), then fall back to the defaults below.
+
+    With several hosts (replicated Valve instances), each request goes to the
+    healthy host with the lowest latency times requests in flight, so
+    concurrent requests spread across them.  A connection error, timeout,
+    5xx response or a body that breaks off is retried on the next best host.
+    A host that fails breakerFailures times in a row is skipped for
+    breakerReset seconds, then given one trial request.  Bodies of
+    stream=True requests are read later, through read(), which fails over
+    the same way.
+
+    Parameters
+    ----------
+    host: string or list
+        Valve host, or list of mirror hosts.  default is config['hosts'] or
+        config['host'] at the time of the request
+    poolSize: int
+        number of keep-alive connections kept open to each host.  default is 10
+    retries: int
+        number of times a failed connection or 5xx response is retried.
+        default is 3
+    backoff: float
+        backoff factor in seconds between retries (0.5 gives 0.5, 1, 2...).
+        default is 0.5
+    timeout: float or tuple
+        (connect, read) timeout in seconds.  default is (10, 120)
+    breakerFailures: int
+        consecutive failures that take a host out of rotation.  default is 3
+    breakerReset: float
+        seconds a failed host is left out.  default is 30
+    '''
+    def __init__(self, host=None, poolSize=None, retries=None, backoff=None, timeout=None,
+                 breakerFailures=None, breakerReset=None):
+        import threading
+        self.host = host
+        self.poolSize = poolSize
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.breakerFailures = breakerFailures
+        self.breakerReset = breakerReset
+        self.session = None
+        self.hostStats = {}
+        self.lock = threading.Lock()
+
+    def connect(self):
+        '''
+        Builds the pooled session on first use, filling in unset settings
+        from config.  Returns the session.
+        '''
+        with self.lock:
+            if self.session is not None:
+                return self.session
+            cfg = settings()
+            if self.poolSize is None:
+                self.poolSize = cfg.get('poolSize', 10)
+            if self.retries is None:
+                self.retries = cfg.get('retries', 3)
+            if self.backoff is None:
+                self.backoff = cfg.get('backoff', 0.5)
+            if self.breakerFailures is None:
+                self.breakerFailures = cfg.get('breakerFailures', 3)
+            if self.breakerReset is None:
+                self.breakerReset = cfg.get('breakerReset', 30)
+            timeout = self.timeout if self.timeout is not None else cfg.get('timeout', (10, 120))
+            self.timeout = tuple(timeout) if isinstance(timeout, list) else timeout
+            if len(self.hosts()) > 1:
+                retry = 0   # get() fails over to another host instead
+            else:
+                retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                              status_forcelist=(500, 502, 503, 504))
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.poolSize,
+                                                    pool_maxsize=self.poolSize,
+                                                    max_retries=retry)
+            session = requests.Session()
+            session.headers['Connection'] = 'keep-alive'
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.session = session
+            return session
+
+    def hosts(self):
+        '''
+        Returns the list of Valve hosts, from the client or config.
+        '''
+        cfg = settings()
+        hosts = self.host or cfg.get('hosts') or cfg.get('host')
+        if not hosts:
+            raise ValueError('No Valve host set: pass host to configureClient(), or give '
+                             'one in config.json (see loadConfig)')
+        if isinstance(hosts, basestring):
+            hosts = [hosts]
+        return list(hosts)
+
+    def hostName(self, exclude=()):
+        '''
+        Returns the best host to send a request to (see ValveClient), leaving
+        out those in exclude unless there are no others.
+        '''
+        hosts = self.hosts()
+        if len(hosts) == 1:
+            return hosts[0]
+        now = time.time()
+        with self.lock:
+            candidates = [h for h in hosts if h not in exclude] or hosts
+            stats = [self.hostStats.setdefault(h, HostStats(h)) for h in candidates]
+            best = min(stats, key=lambda st: st.score(now))
+            if best.openUntil > now:
+                # every host is out; try the one that comes back soonest
+                best = min(stats, key=lambda st: st.openUntil)
+            return best.host
+
+    def url(self, endpoint, host=None):
+        '''
+        Returns the full url of the REST endpoint (ex. 'rsam' or 'tilt') on
+        host (default hostName())
+        '''
+        host = host or self.hostName()
+        if '://' not in host:
+            host = 'http://%s' % host
+        return '%s/api/%s' % (host, endpoint)
+
+    def report(self, host, latency=None):
+        '''
+        Updates the stats of host after a request: latency in seconds, or
+        None if it failed.
+        '''
+        with self.lock:
+            st = self.hostStats.setdefault(host, HostStats(host))
+            st.inflight -= 1
+            st.requests += 1
+            if latency is None:
+                self.failed(st)
+            else:
+                st.failures = 0
+                st.openUntil = 0
+                st.latency = latency if st.latency is None else 0.8 * st.latency + 0.2 * latency
+
+    def failed(self, st):
+        '''
+        Counts an error in HostStats st, opening its circuit after
+        breakerFailures in a row.  Called with the lock held.
+        '''
+        st.errors += 1
+        st.failures += 1
+        if st.failures >= self.breakerFailures:
+            st.openUntil = time.time() + self.breakerReset
+            logger.warning('Valve host %s failed %d times, leaving it out for %s seconds',
+                           st.host, st.failures, self.breakerReset)
+
+    def read(self, resp, parse, *args, **kwargs):
+        '''
+        Returns parse(resp, *args, **kwargs) for a response from get().  A
+        body that breaks off or does not parse counts as an error of the host
+        that sent it, and the request is sent again to the next best host
+        until every host has been tried.
+        '''
+        tried = []
+        first = resp
+        try:
+            while True:
+                try:
+                    return parse(resp, *args, **kwargs)
+                except (requests.RequestException, ValueError) as e:
+                    host = getattr(resp, 'valveHost', None)
+                    if host is None:
+                        raise
+                    with self.lock:
+                        self.failed(self.hostStats.setdefault(host, HostStats(host)))
+                    tried.append(host)
+                    if len(tried) >= len(self.hosts()):
+                        raise
+                    logger.info('Reading the answer of %s failed (%s), trying another host', host, e)
+                    endpoint, params, options = resp.valveRequest
+                    if resp is not first:
+                        resp.close()
+                    resp = self.get(endpoint, params, avoid=tried, **options)
+        finally:
+            if resp is not first:
+                resp.close()
+
+    def options(self):
+        '''
+        Returns the keyword arguments that build a ValveClient with the same
+        settings (ex. in another process).
+        '''
+        return {'host': self.host, 'poolSize': self.poolSize, 'retries': self.retries,
+                'backoff': self.backoff, 'timeout': self.timeout,
+                'breakerFailures': self.breakerFailures, 'breakerReset': self.breakerReset}
+
+    def stats(self):
+        '''
+        Returns {host: {'requests', 'errors', 'failures', 'latency',
+        'inflight', 'open'}} for every host used so far.
+        '''
+        with self.lock:
+            return dict((h, st.summary()) for h, st in self.hostStats.items())
+
+    def get(self, endpoint, params=None, avoid=(), **kwargs):
+        '''
+        Issues a GET against the endpoint through the pooled session, failing
+        over to other hosts when there are several, starting with those not
+        in avoid.  Extra keyword arguments are handed to requests (ex.
+        stream=True).
+        '''
+        hosts = self.hosts()
+        session = self.session or self.connect()
+        kwargs.setdefault('timeout', self.timeout)
+        if len(hosts) == 1:
+            return session.get(self.url(endpoint, hosts[0]), params=params, **kwargs)
+        tried = []
+        error = None
+        for attempt in range(max(self.retries + 1, len(hosts))):
+            if isinstance(error, requests.Response):
+                error.close()
+            if len(tried) >= len(hosts) and self.backoff:
+                time.sleep(self.backoff * 2 ** (len(tried) // len(hosts) - 1))
+            host = self.hostName(list(avoid) + tried[1 - len(hosts):])
+            tried.append(host)
+            with self.lock:
+                self.hostStats.setdefault(host, HostStats(host)).inflight += 1
+            start = time.time()
+            latency = None
+            try:
+                resp = session.get(self.url(endpoint, host), params=params, **kwargs)
+                if resp.status_code >= 500:
+                    logger.info('%s answered %d, trying another host', host, resp.status_code)
+                    error = resp
+                    continue
+                if not kwargs.get('stream'):
+                    resp.content
+                    checkLength(resp)
+                resp.valveHost = host
+                resp.valveRequest = (endpoint, params, kwargs)
+                latency = time.time() - start
+                return resp
+            except requests.RequestException as e:
+                logger.info('Request to %s failed (%s), trying another host', host, e)
+                error = e
+            finally:
+                self.report(host, latency)
+        if isinstance(error, Exception):
+            raise error
+        error.raise_for_status()
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+client = ValveClient()
+
+def checkLength(resp):
+    '''
+    Raises requests.ConnectionError if fewer bytes of the body of resp came
+    over the wire than its Content-Length (a connection that broke off),
+    once the body has been read.
+    '''
+    length = resp.headers.get('Content-Length', '')
+    tell = getattr(resp.raw, 'tell', None)
+    if tell is not None and length.isdigit() and tell() < int(length):
+        raise requests.ConnectionError('Response from %s broke off after %d of %s bytes'
+                                       % (resp.url, tell(), length))
+
+def wireBytes(resp, default=0):
+    '''
+    Returns the bytes of the body of resp read off the wire so far (the
+    compressed size when the response is gzipped), or its Content-Length
+    when that can not be told, or default when neither is known.
+    '''
+    tell = getattr(getattr(resp, 'raw', None), 'tell', None)
+    if tell is not None:
+        return tell()
+    length = resp.headers.get('Content-Length', '')
+    return int(length) if length.isdigit() else default
+
+def configureClient(**kwargs):
+    '''
+    Replaces the module level client with a new ValveClient built from the
+    keyword arguments (see ValveClient), closing the old connection pool.
+    '''
+    global client
+    client.close()
+    client = ValveClient(**kwargs)
+    return client
+
+
 def dump(response):
     '''
     Testing function for seeing what is coming back in response.
@@ -48,44 +425,376 @@ def rsaminfo():
     '''
     Prints to the screen information about the rsam dataset in the REST interface
     '''
-    resp = requests.get('http://%s/api/rsam' % (config['host']))
+    resp = client.get('rsam')
     print resp.text
     
 def triggersinfo():
     '''
     Prints to the screen information about the triggers dataset in the REST interface
     '''
-    resp = requests.get('http://%s/api/triggers' % (config['host']))
+    resp = client.get('triggers')
     print resp.text
     
 def tiltinfo():
     '''
     Prints to the screen information about the tilt dataset in the REST interface
     '''
-    resp = requests.get('http://%s/api/tilt' % (config['host']))
+    resp = client.get('tilt')
     print resp.text
     
 def flyspecinfo():
     '''
     Prints to the screen information about the flyspec dataset in the REST interface
     '''
-    resp = requests.get('http://%s/api/flyspec' % (config['host']))
+    resp = client.get('flyspec')
     print resp.text
     
 def straininfo():
     '''
     Prints to the screen information about the strain dataset in the REST interface
     '''
-    resp = requests.get('http://%s/api/strain' % (config['host']))
+    resp = client.get('strain')
     print resp.text
     
 def gpsinfo():
     '''
     Prints to the screen information about the gps dataset in the REST interface
     '''
-    resp = requests.get('http://%s/api/gps' % (config['host']))
+    resp = client.get('gps')
     print resp.text
     
+def parseInfo(text):
+    '''
+    Parses the response of a dataset's info request (ex. rsaminfo()) into
+    a dict of 'channels' (code: dict of whatever the server lists for it,
+    with 'start'/'end' epoch seconds and 'interval' seconds when known),
+    'series' (tuple of names) and 'ranks' (id: name).  Sections missing
+    from the response come back empty.
+    '''
+    try:
+        info = json.loads(text)
+    except ValueError:
+        info = {}
+    if not isinstance(info, dict):
+        info = {'channels': info}
+
+    def pick(item, *keys):
+        for key in keys:
+            if key in item:
+                return item[key]
+        return None
+
+    def epoch(value):
+        try:
+            return toEpoch([value])[0] if value not in (None, '') else None
+        except Exception:
+            return None
+
+    channels = {}
+    listed = pick(info, 'channels', 'channel', 'stations') or []
+    if isinstance(listed, dict):
+        listed = [dict(v, code=k) if isinstance(v, dict) else {'code': k, 'name': v}
+                  for k, v in listed.items()]
+    for item in listed:
+        if not isinstance(item, dict):
+            item = {'code': item}
+        code = pick(item, 'code', 'channel', 'name', 'id')
+        if code is None:
+            continue
+        item = dict(item)
+        item['start'] = epoch(pick(item, 'start', 'starttime', 'startdate', 'firstdate'))
+        item['end'] = epoch(pick(item, 'end', 'endtime', 'enddate', 'lastdate'))
+        interval = pick(item, 'interval', 'sampleinterval', 'delta')
+        if interval is None and pick(item, 'samplerate', 'rate'):
+            interval = 1.0 / float(pick(item, 'samplerate', 'rate'))
+        item['interval'] = float(interval) if interval is not None else None
+        channels[str(code)] = item
+    series = pick(info, 'series', 'columns') or ()
+    if isinstance(series, dict):
+        series = series.keys()
+    series = tuple(str(s.get('name', s) if isinstance(s, dict) else s) for s in series)
+    ranks = {}
+    listed = pick(info, 'ranks', 'rank') or ()
+    if isinstance(listed, dict):
+        listed = [{'id': k, 'name': v} for k, v in listed.items()]
+    for item in listed:
+        if isinstance(item, dict):
+            key, name = pick(item, 'id', 'rank', 'code'), pick(item, 'name', 'description')
+        else:
+            key, name = item, item
+        try:
+            ranks[int(key)] = name
+        except (TypeError, ValueError):
+            ranks[key] = name
+    return {'channels': channels, 'series': series, 'ranks': ranks}
+
+class Catalog(object):
+    '''
+    Channel, series and rank listings of every dataset, from the same info
+    requests as rsaminfo() etc.  They are fetched once, kept on disk and
+    fetched again when older than ttl, and looked up from dicts.
+
+    Parameters
+    ----------
+    path: string
+        json file the info responses are kept in.  default is
+        config['catalogPath'] or ~/.valveData/catalog.json
+    ttl: float
+        seconds before the info is fetched again.  default is 86400
+    '''
+    def __init__(self, path=None, ttl=86400):
+        import os
+        import threading
+        self.path = os.path.expanduser(path or settings().get('catalogPath', '~/.valveData/catalog.json'))
+        self.ttl = ttl
+        self.info = None
+        self.fetched = None
+        self.lock = threading.Lock()
+
+    def load(self, refresh=False):
+        '''
+        Makes sure the info is loaded and fresh, reading it from disk or
+        fetching it as needed.  refresh fetches it regardless.  Returns the
+        parsed info by dataset.
+        '''
+        import os
+        with self.lock:
+            now = time.time()
+            if not refresh and self.info is not None and now - self.fetched < self.ttl:
+                return self.info
+            saved = None
+            if not refresh and os.path.exists(self.path):
+                try:
+                    with open(self.path) as f:
+                        saved = json.load(f)
+                except ValueError:
+                    logger.warning('Ignoring unreadable catalog %s', self.path)
+            if saved is None or now - saved['fetched'] >= self.ttl:
+                saved = {'fetched': now, 'raw': {}}
+                for dataset, entry in datasets.items():
+                    saved['raw'][dataset] = client.get(entry['endpoint']).text
+                self.save(saved)
+            self.fetched = saved['fetched']
+            self.info = dict((dataset, parseInfo(text)) for dataset, text in saved['raw'].items())
+            return self.info
+
+    def save(self, saved):
+        import os
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(saved, f)
+        os.rename(tmp, self.path)
+
+    def channels(self, dataset):
+        '''Returns a dict of channel code: channel info for dataset'''
+        return self.load().get(dataset, {}).get('channels', {})
+
+    def series(self, dataset):
+        '''Returns the series names the server lists for dataset'''
+        return self.load().get(dataset, {}).get('series', ())
+
+    def ranks(self, dataset):
+        '''Returns a dict of rank id: rank name for dataset'''
+        return self.load().get(dataset, {}).get('ranks', {})
+
+    def channel(self, dataset, channel):
+        '''Returns the info for one channel, or None if it is not listed'''
+        return self.channels(dataset).get(channel)
+
+    def coverage(self, dataset, channel):
+        '''Returns (start, end) epoch seconds of a channel, or None if unknown'''
+        item = self.channel(dataset, channel)
+        if item is None or item['start'] is None:
+            return None
+        return item['start'], item['end']
+
+    def interval(self, dataset, channel):
+        '''Returns seconds per sample of a channel, or None if unknown'''
+        item = self.channel(dataset, channel)
+        return None if item is None else item['interval']
+
+    def validate(self, dataset, channel, series=None):
+        '''
+        Raises ValueError if the catalog lists channels (or series) for
+        dataset and channel (or series) is not one of them.
+        '''
+        channels = self.channels(dataset)
+        if channels and channel not in channels:
+            raise ValueError('Unknown %s channel %r' % (dataset, channel))
+        listed = self.series(dataset)
+        if series is not None and listed and series not in listed:
+            raise ValueError('Unknown %s series %r, expected one of %s' % (dataset, series, list(listed)))
+
+catalog = None
+
+def enableCatalog(path=None, ttl=86400):
+    '''
+    Turns on the Catalog, so fetch() checks channels and series against it
+    before making a request and plans maxPoints from each channel's own
+    sample interval.  See Catalog for the parameters.  disableCatalog()
+    turns it off again.
+    '''
+    global catalog
+    catalog = Catalog(path, ttl)
+    return catalog
+
+def disableCatalog():
+    global catalog
+    catalog = None
+
+class Stage(object):
+    '''
+    One timed run of a pipeline stage, made by stage().  Call done() when
+    the stage finishes, with what it handled.
+    '''
+    __slots__ = ('metrics', 'name', 'dataset', 'start')
+
+    def __init__(self, metrics, name, dataset):
+        self.metrics = metrics
+        self.name = name
+        self.dataset = dataset
+        self.start = time.time()
+
+    def done(self, bytes=0, records=0, nbytes=0):
+        '''
+        Records the stage.  bytes is data received over the wire (before
+        decompression, see wireBytes), records the samples handled and
+        nbytes the size of the arrays made (an approximation of what the
+        stage allocated).
+        '''
+        self.metrics.record(self.name, self.dataset, time.time() - self.start,
+                            bytes, records, nbytes)
+
+class NullStage(object):
+    '''Stage handed out while no Metrics are collecting'''
+    __slots__ = ()
+
+    def done(self, bytes=0, records=0, nbytes=0):
+        pass
+
+nullStage = NullStage()
+
+class Metrics(object):
+    '''
+    Collects wall time, bytes received over the wire, record counts and
+    array bytes for each pipeline stage (request, json, records,
+    parseJsonStream, parseCsvStream, fetch,
+    findGaps, splitSegments, splitData, data2obspy, segments2obspy), by
+    dataset where known.  Use collect() or enableMetrics() to turn it on;
+    while off, every stage costs one function call.
+
+    Parameters
+    ----------
+    hook: function
+        optional function called as hook(stage, dataset, seconds, bytes,
+        records, nbytes) for every stage recorded
+    '''
+    fields = ('count', 'seconds', 'bytes', 'records', 'nbytes')
+
+    def __init__(self, hook=None):
+        import threading
+        self.hook = hook
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, dataset, seconds, bytes=0, records=0, nbytes=0):
+        with self.lock:
+            totals = self.stages.setdefault((name, dataset or ''), [0, 0.0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += bytes
+            totals[3] += records
+            totals[4] += nbytes
+        if self.hook is not None:
+            self.hook(name, dataset, seconds, bytes, records, nbytes)
+
+    def summary(self):
+        '''
+        Returns {(stage, dataset): {'count', 'seconds', 'bytes', 'records',
+        'nbytes'}} of everything recorded so far.
+        '''
+        with self.lock:
+            return dict((key, dict(zip(self.fields, totals))) for key, totals in self.stages.items())
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+
+    def log(self, level=logging.INFO):
+        '''
+        Writes one key=value line per stage and dataset to the 'valveData'
+        logger.
+        '''
+        for (name, dataset), totals in sorted(self.summary().items()):
+            logger.log(level, 'stage=%s dataset=%s count=%d seconds=%.6f bytes=%d records=%d nbytes=%d',
+                       name, dataset or '-', totals['count'], totals['seconds'], totals['bytes'],
+                       totals['records'], totals['nbytes'])
+
+    def prometheus(self, prefix='valvedata'):
+        '''
+        Returns the totals as Prometheus text exposition format counters,
+        labelled by stage and dataset.
+        '''
+        summary = sorted(self.summary().items())
+        lines = []
+        for field in self.fields:
+            metric = '%s_stage_%s_total' % (prefix, field)
+            lines.append('# TYPE %s counter' % metric)
+            for (name, dataset), totals in summary:
+                lines.append('%s{stage="%s",dataset="%s"} %s' % (metric, name, dataset, repr(totals[field])))
+        return '\n'.join(lines) + '\n'
+
+metrics = None
+
+def stage(name, dataset=None):
+    '''
+    Starts timing a stage.  Returns a Stage, or a do-nothing stand-in when
+    no Metrics are collecting.
+    '''
+    if metrics is None:
+        return nullStage
+    return Stage(metrics, name, dataset)
+
+def enableMetrics(hook=None):
+    '''
+    Turns on stage Metrics for everything the module does.  See Metrics for
+    the parameters.  disableMetrics() turns them off again.
+    '''
+    global metrics
+    metrics = Metrics(hook)
+    return metrics
+
+def disableMetrics():
+    global metrics
+    metrics = None
+
+class collect(object):
+    '''
+    Collects stage Metrics for the body of a with block, then puts back
+    whatever was collecting before.
+
+        with valveData.collect() as m:
+            valveData.getTiltSpan('UWE', '201504150000', '201504160000')
+        print m.prometheus()
+    '''
+    def __init__(self, hook=None):
+        self.metrics = Metrics(hook)
+        self.previous = None
+
+    def __enter__(self):
+        global metrics
+        self.previous = metrics
+        metrics = self.metrics
+        return self.metrics
+
+    def __exit__(self, *exc):
+        global metrics
+        metrics = self.previous
+        return False
+
 gmt_j2koffset = 946764000
 hst_j2koffset = 946728000
 
@@ -99,8 +808,711 @@ def j2k_to_date(j2k, hst=False):
         return datetime.fromtimestamp(j2k + hst_j2koffset)
     else:
         return datetime.fromtimestamp(j2k + gmt_j2koffset)
-        
-def getRsamLast(channel, starttime, timezone='utc', downsample='none', dsint=10):
+
+# Valve datasets.  For each: the api endpoint, the series it serves (None
+# when the records are always labelled 'label'), the nominal seconds per
+# sample and the request parameters sent when the caller does not override
+# them.  'csv' marks the high volume datasets whose fast fetches ask for csv
+# (see fetchPayload).  Used by fetch() and everything built on it.
+datasets = {'rsam': {'endpoint': 'rsam', 'series': None, 'label': 'rsam', 'interval': 60,
+                     'defaults': {'downsample': 'none', 'dsint': 10}},
+            'triggers': {'endpoint': 'triggers', 'series': None, 'label': 'triggers', 'interval': 60,
+                         'defaults': {}},
+            'tilt': {'endpoint': 'tilt', 'interval': 1, 'csv': True,
+                     'series': ('radial', 'tangential', 'east', 'north', 'rainfall'),
+                     'defaults': {'downsample': 'none', 'dsint': 10, 'series': 'radial', 'rank': 1}},
+            'flyspec': {'endpoint': 'flyspec', 'interval': 10,
+                        'series': ('bstflux', 'bstfluxmean', 'bstfluxmeanstdev', 'ps', 'pd'),
+                        'defaults': {'downsample': 'none', 'dsint': 10, 'series': 'bstflux', 'rank': 2}},
+            'strain': {'endpoint': 'strain', 'interval': 1,
+                       'series': ('dt01', 'dt02', 'barometer'),
+                       'defaults': {'debias': 'none', 'series': 'dt01'}},
+            'gps': {'endpoint': 'gps', 'series': None, 'label': 'length', 'interval': 86400,
+                    'defaults': {'dsint': 10, 'series': 'length'}},
+            'rtnet': {'endpoint': 'rtnet', 'interval': 1, 'csv': True,
+                      'series': ('east', 'north', 'up'),
+                      'defaults': {'series': 'up', 'rank': 4}}}
+# Valve time string formats by length
+vtimeFormats = {4: '%Y', 6: '%Y%m', 8: '%Y%m%d', 10: '%Y%m%d%H',
+                12: '%Y%m%d%H%M', 14: '%Y%m%d%H%M%S'}
+
+def parseVtime(vtime):
+    '''
+    Returns a datetime for an absolute valve time string (yyyy[MMdd[hhmm[ss]]]),
+    or None if it is relative (ex. '-12h') or not understood.
+    '''
+    from datetime import datetime
+    vtime = str(vtime)
+    if not vtime.isdigit() or len(vtime) not in vtimeFormats:
+        return None
+    return datetime.strptime(vtime, vtimeFormats[len(vtime)])
+
+def chunkWindows(dataset, payload, chunk):
+    '''
+    Splits the starttime/endtime of a Span payload into a list of
+    (starttime, endtime) valve time strings.  chunk is the window length in
+    seconds, or 'auto' for config['chunkSamples'] (default 50000) samples at
+    the dataset sample rate.  Returns None when the times are not absolute.
+    Raises ValueError if the window length is not positive.
+    '''
+    from datetime import timedelta
+    if chunk == 'auto':
+        interval = datasets[dataset]['interval'] if dataset in datasets else 1
+        if payload.get('downsample', 'none') != 'none':
+            interval *= payload.get('dsint', 1)
+        chunk = settings().get('chunkSamples', 50000) * interval
+    if not chunk > 0:
+        raise ValueError('chunk must be a positive number of seconds or \'auto\' with a '
+                         'positive config[\'chunkSamples\'], got %r' % (chunk,))
+    start = parseVtime(payload['starttime'])
+    end = parseVtime(payload['endtime'])
+    if start is None or end is None or end <= start:
+        return None
+    step = timedelta(seconds=chunk)
+    windows = []
+    while start < end:
+        stop = min(start + step, end)
+        windows.append((start.strftime('%Y%m%d%H%M%S'), stop.strftime('%Y%m%d%H%M%S')))
+        start = stop
+    return windows
+
+# Seconds in each unit of a relative valve time (ex. '-12h')
+relativeUnits = {'i': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400,
+                 'm': 30 * 86400, 'y': 365 * 86400}
+
+def windowSeconds(starttime, endtime=None):
+    '''
+    Returns the length in seconds of a starttime/endtime request window, or
+    None if it is not understood.  starttime may be relative (ex. '-12h',
+    '30i'), in which case it is the window length itself; a missing endtime
+    is now.
+    '''
+    from datetime import datetime
+    starttime = str(starttime).lstrip('-')
+    if starttime[:-1].isdigit() and starttime[-1:] in relativeUnits:
+        return int(starttime[:-1]) * relativeUnits[starttime[-1]]
+    start = parseVtime(starttime)
+    end = datetime.utcnow() if endtime is None else parseVtime(endtime)
+    if start is None or end is None:
+        return None
+    return max((end - start).total_seconds(), 0)
+
+def planDownsample(dataset, starttime, endtime, maxPoints, method='mean', interval=None):
+    '''
+    Works out the downsampling parameters that bring a request down to about
+    maxPoints samples (ex. the pixel width of a plot).
+
+    Parameters
+    ----------
+    dataset: string
+        dataset name (see datasets)
+    starttime, endtime: string
+        the request window, as passed to fetch()
+    maxPoints: int
+        number of samples wanted
+    method: string
+        downsample method to use, 'mean' or 'decimate'.  default is 'mean'
+    interval: number
+        seconds per sample of the channel.  default is the dataset's nominal
+        interval
+
+    Outputs
+    ---------
+    options: dict
+        request parameters to add (downsample and/or dsint).  Empty when the
+        window is already small enough, can not be worked out, or the
+        dataset can not be downsampled
+    '''
+    defaults = datasets[dataset]['defaults']
+    seconds = windowSeconds(starttime, endtime)
+    if 'dsint' not in defaults or seconds is None:
+        return {}
+    if interval is None:
+        interval = datasets[dataset]['interval']
+    dsint = int(-(-seconds // (interval * max(int(maxPoints), 1))))
+    options = {}
+    if 'downsample' in defaults:
+        options['downsample'] = method if dsint > 1 else 'none'
+    options['dsint'] = max(dsint, 1)
+    return options
+
+# Whether each csv dataset's server answered format=csv, learned by
+# fetchPayload on first use
+csvFormat = {}
+
+def fetchPayload(dataset, payload, channel, series, fast=False):
+    '''
+    Issues one request and parses it.  fast requests are streamed through
+    parseJsonStream, so the full response is never held in memory.  For
+    datasets marked 'csv' in datasets, fast requests ask for format=csv and
+    stream the table through parseCsvStream when the server sends one.  csv
+    is turned off for the dataset in csvFormat when the server answers it
+    with json, or with a 400 and then answers the same request without
+    format=csv; other errors are raised and leave csvFormat as it was.
+    '''
+    endpoint = datasets[dataset]['endpoint']
+    timer = stage('request', dataset)
+    if fast:
+        rejected = False   # format=csv got a 400, see if json works
+        if datasets[dataset].get('csv') and csvFormat.get(dataset, True):
+            resp = client.get(endpoint, params=dict(payload, format='csv'), stream=True,
+                              headers={'Accept': 'text/csv, application/json;q=0.5'})
+            timer.done()
+            try:
+                rejected = resp.status_code == 400
+                if not rejected:
+                    resp.raise_for_status()
+                    if 'csv' in resp.headers.get('Content-Type', ''):
+                        csvFormat[dataset] = True
+                        return client.read(resp, parseCsvStream, series, dataset=dataset)
+                    logger.info('%s did not answer format=csv, using json', dataset)
+                    csvFormat[dataset] = False
+                    return client.read(resp, parseJsonStream, channel, series, dataset=dataset)
+            finally:
+                resp.close()
+            timer = stage('request', dataset)
+        resp = client.get(endpoint, params=payload, stream=True)
+        timer.done()
+        try:
+            resp.raise_for_status()
+            result = client.read(resp, parseJsonStream, channel, series, dataset=dataset)
+        finally:
+            resp.close()
+        if rejected:
+            logger.info('%s rejected format=csv, using json', dataset)
+            csvFormat[dataset] = False
+        return result
+    resp = client.get(endpoint, params=payload)
+    timer.done(bytes=wireBytes(resp))
+    resp.raise_for_status()
+    return client.read(resp, parseJson, channel, series, dataset=dataset)
+
+def fetchLast(dataset, payload, channel, series, fast=False):
+    '''
+    Fetches a Last payload and parses it (see parseJson for fast).  When a
+    LastCache is enabled (see enableLastCache), identical requests within its
+    ttl share one result.
+    '''
+    if lastCache is not None:
+        key = (dataset, tuple(sorted(payload.items())), series, fast)
+        return lastCache.get(key, lambda: fetchPayload(dataset, payload, channel, series, fast))
+    return fetchPayload(dataset, payload, channel, series, fast)
+
+class LastCache(object):
+    '''
+    In-memory LRU cache with a time to live for the relative get*Last
+    requests.  Identical requests made while one is already in flight wait
+    for it instead of issuing their own (single-flight), so many callers
+    asking at once cost one round trip.  Each caller gets its own copy of
+    the result.
+
+    Parameters
+    ----------
+    ttl: float
+        seconds a result is reused for.  default is 30
+    maxEntries: int
+        number of results kept.  default is 256
+    '''
+    def __init__(self, ttl=30, maxEntries=256):
+        import threading
+        from collections import OrderedDict
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        '''
+        Returns the cached result for key, or calls compute() to make it.
+        '''
+        import threading
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                del self.entries[key]
+                self.entries[key] = entry
+                return self.copy(entry[1])
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = {'event': threading.Event(), 'result': None, 'error': None}
+                self.inflight[key] = flight
+        if not leader:
+            flight['event'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return self.copy(flight['result'])
+        try:
+            flight['result'] = compute()
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+                if flight['error'] is None:
+                    self.entries.pop(key, None)
+                    self.entries[key] = (time.time() + self.ttl, flight['result'])
+                    while len(self.entries) > self.maxEntries:
+                        self.entries.popitem(last=False)
+            flight['event'].set()
+        return self.copy(flight['result'])
+
+    def copy(self, result):
+        return tuple(r.copy() if hasattr(r, 'copy') else list(r) for r in result)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+lastCache = None
+
+def enableLastCache(ttl=30, maxEntries=256):
+    '''
+    Turns on the in-memory LastCache for all get*Last functions.  See
+    LastCache for the parameters.  disableLastCache() turns it off again.
+    '''
+    global lastCache
+    lastCache = LastCache(ttl, maxEntries)
+    return lastCache
+
+def disableLastCache():
+    global lastCache
+    lastCache = None
+
+def fetchSpan(dataset, payload, channel, series, chunk=None, fast=False):
+    '''
+    Fetches a Span payload and parses it.  With chunk set, the window is
+    split by chunkWindows, the pieces are fetched in parallel (at most
+    config['chunkWorkers'], default 4, at a time), and samples repeated on
+    the chunk boundaries are dropped while stitching them back in order.
+    When a SeriesCache is enabled (see enableCache), absolute windows in the
+    past are served from it.
+    '''
+    if cache is not None:
+        cached = cache.fetch(dataset, payload, channel, series, chunk)
+        if cached is not None:
+            if fast:
+                return cached
+            return epoch2utc(cached[0]), list(cached[1]), list(cached[2])
+    return fetchSpanDirect(dataset, payload, channel, series, chunk, fast)
+
+def fetchSpanDirect(dataset, payload, channel, series, chunk=None, fast=False):
+    '''
+    fetchSpan without the cache.
+    '''
+    windows = None
+    if chunk is not None:
+        windows = chunkWindows(dataset, payload, chunk)
+    if windows is None or len(windows) == 1:
+        return fetchPayload(dataset, payload, channel, series, fast)
+    from multiprocessing.pool import ThreadPool
+
+    def run(window):
+        piece = dict(payload, starttime=window[0], endtime=window[1])
+        return fetchPayload(dataset, piece, channel, series, fast)
+
+    pool = ThreadPool(min(settings().get('chunkWorkers', 4), len(windows)))
+    try:
+        pieces = pool.map(run, windows)
+    finally:
+        pool.close()
+        pool.join()
+    return stitch(pieces, fast)
+
+def stitch(pieces, fast=False):
+    '''
+    Joins (date, datenum, data) pieces that are in time order, dropping
+    samples at the start of a piece that are not after the end of the
+    previous one.  fast pieces are numpy arrays (see parseJson).
+    '''
+    if fast:
+        import numpy
+        keep = []
+        last = None
+        for pepoch, pdatenum, pdata in pieces:
+            first = 0 if last is None else numpy.searchsorted(pepoch, last, side='right')
+            keep.append((pepoch[first:], pdatenum[first:], pdata[first:]))
+            if len(pepoch) > 0:
+                last = pepoch[-1] if last is None else max(last, pepoch[-1])
+        if not keep:
+            empty = numpy.zeros(0)
+            return empty, empty.copy(), empty.copy()
+        return tuple(numpy.concatenate([k[i] for k in keep]) for i in range(3))
+    date = []
+    datenum = []
+    data = []
+    for pdate, pdatenum, pdata in pieces:
+        first = 0
+        if date:
+            while first < len(pdate) and pdate[first] <= date[-1]:
+                first += 1
+        date.extend(pdate[first:])
+        datenum.extend(pdatenum[first:])
+        data.extend(pdata[first:])
+    return date, datenum, data
+
+class SeriesCache(object):
+    '''
+    On-disk cache of fetched series.  Each day of a series is stored as a
+    compressed .npz file of epoch seconds and data under
+    root/dataset/channel/series/rank/params/yyyymmdd.npz, where params is a
+    hash of the other request parameters (timezone, downsample, dsint...).
+    Only days that ended more than lag seconds ago are cached, since those
+    are not expected to change; a request only fetches the days it does not
+    already have, plus the recent days that are not settled yet.  When the
+    files pass maxBytes, the least recently used days are deleted.
+
+    Parameters
+    ----------
+    root: string
+        directory to keep the cache in
+    maxBytes: int
+        size limit of the cache in bytes.  default is 1 GB
+    lag: float
+        seconds after the end of a day before it is cached.  default is one
+        day, to allow for late arriving data
+    '''
+    def __init__(self, root, maxBytes=2**30, lag=86400):
+        import os
+        import threading
+        self.root = root
+        self.maxBytes = maxBytes
+        self.lag = lag
+        self.lock = threading.Lock()
+        self.size = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in filenames:
+                if name.endswith('.npz'):
+                    self.size += os.path.getsize(os.path.join(dirpath, name))
+
+    def directory(self, dataset, payload, series):
+        '''
+        Returns the directory holding the days of this request.
+        '''
+        import os
+        import hashlib
+        from urllib import quote
+        ignore = ('channel', 'series', 'rank', 'starttime', 'endtime')
+        params = sorted((k, str(v)) for k, v in payload.items() if k not in ignore)
+        digest = hashlib.md5(repr(params)).hexdigest()[:12]
+        name = series if isinstance(series, basestring) else ','.join(series)
+        return os.path.join(self.root, dataset, quote(payload['channel'], safe=''),
+                            quote(str(name), safe=''), str(payload.get('rank', '')), digest)
+
+    def load(self, path):
+        import os
+        import numpy
+        try:
+            with numpy.load(path) as npz:
+                epoch, data = npz['epoch'], npz['data']
+        except (IOError, OSError):
+            return None
+        try:
+            os.utime(path, None)   # mark as recently used
+        except OSError:
+            pass
+        return epoch, data
+
+    def store(self, path, epoch, data):
+        import os
+        import numpy
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                pass
+        tmp = '%s.%d.tmp' % (path, id(epoch))
+        with open(tmp, 'wb') as f:
+            numpy.savez_compressed(f, epoch=epoch, data=data)
+        os.rename(tmp, path)
+        with self.lock:
+            self.size += os.path.getsize(path)
+            if self.size > self.maxBytes:
+                self.evict()
+
+    def evict(self):
+        '''
+        Deletes least recently used days until the cache is under 90% of
+        maxBytes.  Called with the lock held.
+        '''
+        import os
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.npz'):
+                    path = os.path.join(dirpath, name)
+                    st = os.stat(path)
+                    files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        self.size = sum(f[1] for f in files)
+        for mtime, size, path in files:
+            if self.size <= 0.9 * self.maxBytes:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+    def fetch(self, dataset, payload, channel, series, chunk=None):
+        '''
+        Returns (epoch, datenum, data) arrays for a Span payload, fetching
+        and storing the days that are not cached yet, or None if the window
+        is relative or has no settled days.  The part of the window in days
+        that are not settled yet is fetched directly and not stored.
+        '''
+        import os
+        import calendar
+        import numpy
+        from datetime import datetime, timedelta
+        start = parseVtime(payload['starttime'])
+        end = parseVtime(payload['endtime'])
+        if start is None or end is None or end < start:
+            return None
+        day = timedelta(days=1)
+        first = datetime(start.year, start.month, start.day)
+        last = datetime(end.year, end.month, end.day)
+        settled = datetime.utcnow() - timedelta(seconds=self.lag)
+        if first + day > settled:
+            return None
+        tail = None
+        if last + day > settled:
+            # recent days may still change: fetch them directly
+            while last + day > settled:
+                last -= day
+            piece = dict(payload, starttime=(last + day).strftime('%Y%m%d%H%M%S'))
+            tail = fetchSpanDirect(dataset, piece, channel, series, chunk, True)
+        folder = self.directory(dataset, payload, series)
+        days = []
+        d = first
+        while d <= last:
+            days.append(d)
+            d += day
+        path = lambda d: os.path.join(folder, d.strftime('%Y%m%d.npz'))
+        loaded = dict((d, self.load(path(d))) for d in days)
+        # Fetch each run of consecutive missing days in one request
+        runs = []
+        for d in days:
+            if loaded[d] is not None:
+                continue
+            if runs and runs[-1][1] + day == d:
+                runs[-1][1] = d
+            else:
+                runs.append([d, d])
+        for runStart, runEnd in runs:
+            piece = dict(payload, starttime=runStart.strftime('%Y%m%d%H%M%S'),
+                         endtime=(runEnd + day).strftime('%Y%m%d%H%M%S'))
+            epoch, datenum, data = fetchSpanDirect(dataset, piece, channel, series, chunk, True)
+            d = runStart
+            while d <= runEnd:
+                lo = numpy.searchsorted(epoch, calendar.timegm(d.timetuple()))
+                hi = numpy.searchsorted(epoch, calendar.timegm((d + day).timetuple()))
+                loaded[d] = (epoch[lo:hi], data[lo:hi])
+                self.store(path(d), epoch[lo:hi], data[lo:hi])
+                d += day
+        epoch = numpy.concatenate([loaded[d][0] for d in days])
+        data = numpy.concatenate([loaded[d][1] for d in days])
+        lo = numpy.searchsorted(epoch, calendar.timegm(start.timetuple()))
+        hi = numpy.searchsorted(epoch, calendar.timegm(end.timetuple()), side='right')
+        epoch, data = epoch[lo:hi], data[lo:hi]
+        if tail is not None:
+            epoch = numpy.concatenate([epoch, tail[0]])
+            data = numpy.concatenate([data, tail[2]])
+        return epoch, epoch2num(epoch), data
+
+cache = None
+
+def enableCache(root, maxBytes=2**30, lag=86400):
+    '''
+    Turns on the on-disk SeriesCache for all get*Span functions.  See
+    SeriesCache for the parameters.  disableCache() turns it off again.
+    '''
+    global cache
+    cache = SeriesCache(root, maxBytes, lag)
+    return cache
+
+def disableCache():
+    global cache
+    cache = None
+
+def seriesKey(dataset, series):
+    '''
+    Returns the label of the data in the json records for dataset/series,
+    or a tuple of labels for a list of series.
+    '''
+    entry = datasets[dataset]
+    if entry['series'] is None:
+        return entry['label']
+    if isinstance(series, (list, tuple)):
+        return tuple(series)
+    return series or entry['defaults']['series']
+
+def buildPayload(dataset, channel, series, starttime, endtime=None, timezone='utc', options=None):
+    '''
+    Builds the request parameters for a dataset from its datasets entry.
+    options overrides the dataset defaults.
+    '''
+    entry = datasets[dataset]
+    payload = dict(entry['defaults'])
+    payload.update({'channel': channel, 'starttime': starttime, 'timezone': timezone})
+    if endtime is not None:
+        payload['endtime'] = endtime
+    if entry['series'] is not None:
+        label = seriesKey(dataset, series)
+        payload['series'] = label if isinstance(label, basestring) else ','.join(label)
+    payload.update(options or {})
+    return payload
+
+def fetch(dataset, channel, starttime, endtime=None, series=None, timezone='utc',
+          chunk=None, fast=False, maxPoints=None, **options):
+    '''
+    Gets data for any dataset from the REST interface.  All of the get*
+    functions are wrappers around this one.
+
+    Parameters
+    ----------
+    dataset: string
+        'rsam', 'triggers', 'tilt', 'flyspec', 'strain', 'gps' or 'rtnet'
+        (see datasets)
+    channel: string
+        channel name.  see the *info() functions for full listings
+    starttime: string
+        typically in the form of: yyyy[MMdd[hhmm]], or relative to now
+        (ex. '1h', see getRsamLast)
+    endtime: string
+        typically in the form of: yyyy[MMdd[hhmm]].  None fetches starttime
+        to now as the get*Last functions do.  default is None
+    series: string or list
+        series to fetch, usually one of datasets[dataset]['series'] (others
+        are requested anyway, and only rejected by an enabled Catalog).  A
+        list is asked for in one request (series=east,north,up) and gives
+        one data column per series (see fetchSeries).  ignored for rsam,
+        triggers and gps.  default is the dataset default
+    timezone: string
+        timezone for the data.  default is 'utc'
+    chunk: number or string
+        split a Span request into windows (see fetchSpan).  default is None
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
+    maxPoints: int
+        if given, downsample on the server to about this many samples (see
+        planDownsample), overriding downsample and dsint.  A downsample
+        method other than 'none' in options is kept.  default is None
+    options:
+        any other request parameters (ex. downsample='mean', dsint=60,
+        rank=2, debias='none', baseline='MLSP').  unset ones take the
+        dataset defaults
+
+    Outputs
+    ---------
+    date: list
+        List of UTCDateTime objects corresponding to data list
+    datenum: list
+        List of matplotlib datenums
+    data: list
+        List of data
+    '''
+    if dataset not in datasets:
+        raise ValueError('Unknown dataset %r, expected one of %s' % (dataset, sorted(datasets)))
+    allowed = datasets[dataset]['series']
+    names = [series] if series is None or isinstance(series, basestring) else list(series)
+    for name in names:
+        if allowed is not None and name is not None and name not in allowed:
+            # the list is only what is known here; enableCatalog() checks against the server
+            logger.info('%s series %r is not one of %s, requesting it anyway', dataset, name, list(allowed))
+    interval = None
+    if catalog is not None:
+        for name in names:
+            catalog.validate(dataset, channel, name)
+        interval = catalog.interval(dataset, channel)
+    if maxPoints:
+        method = options.get('downsample', 'none')
+        options.update(planDownsample(dataset, starttime, endtime, maxPoints,
+                                      'mean' if method == 'none' else method, interval))
+    timer = stage('fetch', dataset)
+    payload = buildPayload(dataset, channel, series, starttime, endtime, timezone, options)
+    label = seriesKey(dataset, series)
+    if endtime is None:
+        result = fetchLast(dataset, payload, channel, label, fast)
+    else:
+        result = fetchSpan(dataset, payload, channel, label, chunk, fast)
+    timer.done(records=len(result[2]), nbytes=getattr(result[2], 'nbytes', 0))
+    return result
+
+# Whether each dataset's server answered a comma separated series list,
+# learned by fetchSeries on first use
+multiSeries = {}
+
+def fetchSeries(dataset, channel, series, starttime, endtime=None, timezone='utc',
+                chunk=None, **options):
+    '''
+    Gets several series of one channel as a single time vector and a 2-D
+    data array.  The series are first asked for in one request
+    (series=east,north,up) through fetch(); if the server rejects that with
+    a 400 or leaves series out of the records, each series is fetched
+    concurrently and the results are merged on the union of their times.
+    Which way worked is remembered per dataset in multiSeries.  Other
+    errors (connection, unknown channel...) are raised without being
+    remembered.
+
+    Parameters
+    ----------
+    dataset: string
+        'tilt', 'flyspec', 'strain' or 'rtnet'
+    channel: string
+        channel name
+    series: list
+        series names (ex. ['east', 'north', 'up'])
+    starttime, endtime, timezone, chunk, options:
+        as for fetch(), including maxPoints
+
+    Outputs
+    ---------
+    date: numpy array
+        epoch seconds of the samples
+    datenum: numpy array
+        matplotlib datenums of the samples
+    data: numpy array
+        data, one row per sample and one column per series, NaN where a
+        series has no sample at that time
+    '''
+    import numpy
+    series = list(series)
+    if datasets[dataset]['series'] is None:
+        raise ValueError('%s has a single series' % dataset)
+    if multiSeries.get(dataset, True):
+        try:
+            epoch, datenum, data = fetch(dataset, channel, starttime, endtime, tuple(series),
+                                         timezone, chunk, True, **options)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 400:
+                raise
+        except KeyError as e:
+            # the channel was found but a series is missing from its records
+            if not e.args or e.args[0] not in series:
+                raise
+        else:
+            multiSeries[dataset] = True
+            return epoch, datenum, data.reshape(-1, len(series))
+        logger.info('%s did not return %s together, fetching them separately', dataset, ','.join(series))
+        multiSeries[dataset] = False
+    specs = [(dataset, channel, name, starttime, endtime,
+              dict(options, timezone=timezone, chunk=chunk, fast=True)) for name in series]
+    results, errors = fetchMany(specs, len(specs))
+    if errors:
+        raise errors.values()[0]
+    pieces = [results[specKey(spec)] for spec in specs]
+    epoch = reduce(numpy.union1d, [p[0] for p in pieces], numpy.zeros(0))
+    data = numpy.full((len(epoch), len(series)), numpy.nan)
+    for i, (pepoch, pdatenum, pdata) in enumerate(pieces):
+        data[numpy.searchsorted(epoch, pepoch), i] = pdata
+    return epoch, epoch2num(epoch), data
+
+def getRsamLast(channel, starttime, timezone='utc', downsample='none', dsint=10, fast=False):
     '''
     Gets RSAM data from REST interface for the last X time increment.
     
@@ -126,6 +1538,9 @@ def getRsamLast(channel, starttime, timezone='utc', downsample='none', dsint=10)
     dsint: integer
         factor to downsample by.  for example, as dsint of 10 on a 60 sec/sample
         data will result in 600 sec/sample data (1 min to 10 min)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
         
     Outputs
     ---------
@@ -137,12 +1552,10 @@ def getRsamLast(channel, starttime, timezone='utc', downsample='none', dsint=10)
         List of data
         
     '''
-    payload = {'channel': channel, 'starttime': starttime, 'timezone': timezone, 'downsample': downsample, 'dsint': 10}
-    req = requests.get('http://%s/api/rsam' % (config['host']), params=payload)
-    date, datenum, data = parseJson(req, channel, 'rsam')
+    date, datenum, data = fetch('rsam', channel, starttime, timezone=timezone, downsample=downsample, dsint=dsint, fast=fast)
     return date, datenum, data
     
-def getTriggersLast(channel, starttime, timezone='utc'):
+def getTriggersLast(channel, starttime, timezone='utc', fast=False):
     '''
     Gets Trigger data from REST interface for the last X time increment.
     
@@ -163,6 +1576,9 @@ def getTriggersLast(channel, starttime, timezone='utc'):
     timezone: string
         timezone for the data.  default is 'utc'. 'hst' is also accepted, as
         should other timezones, but I don't know for sure
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
         
     Outputs
     ---------
@@ -174,12 +1590,10 @@ def getTriggersLast(channel, starttime, timezone='utc'):
         List of data
         
     '''
-    payload = {'channel': channel, 'starttime': starttime, 'timezone': timezone}
-    req = requests.get('http://%s/api/triggers' % (config['host']), params=payload)
-    date, datenum, data = parseJson(req, channel, 'triggers')
+    date, datenum, data = fetch('triggers', channel, starttime, timezone=timezone, fast=fast)
     return date, datenum, data
     
-def getTiltLast(channel, starttime, timezone='utc', downsample='none', dsint=10, series='radial', rank=1):
+def getTiltLast(channel, starttime, timezone='utc', downsample='none', dsint=10, series='radial', rank=1, fast=False):
     '''
     Gets Tilt data from REST interface for the last X time increment.
     
@@ -212,6 +1626,9 @@ def getTiltLast(channel, starttime, timezone='utc', downsample='none', dsint=10,
     dsint: integer
         factor to downsample by.  for example, as dsint of 10 on a 60 sec/sample
         data will result in 600 sec/sample data (1 min to 10 min)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
         
     Outputs
     ---------
@@ -223,12 +1640,10 @@ def getTiltLast(channel, starttime, timezone='utc', downsample='none', dsint=10,
         List of data
         
     '''
-    payload = {'channel': channel, 'starttime': starttime, 'timezone': timezone, 'downsample': downsample, 'dsint': 10, 'series': series, 'rank': rank}
-    req = requests.get('http://%s/api/tilt' % (config['host']), params=payload)
-    date, datenum, data = parseJson(req, channel, series)
+    date, datenum, data = fetch('tilt', channel, starttime, series=series, timezone=timezone, downsample=downsample, dsint=dsint, rank=rank, fast=fast)
     return date, datenum, data
     
-def getFlySpecLast(channel, starttime, timezone='utc', downsample='none', dsint=10, series='bstflux', rank=2):
+def getFlySpecLast(channel, starttime, timezone='utc', downsample='none', dsint=10, series='bstflux', rank=2, fast=False):
     '''
     Gets Flypec data from REST interface for the last X time increment.
     
@@ -267,6 +1682,9 @@ def getFlySpecLast(channel, starttime, timezone='utc', downsample='none', dsint=
           1: Raw Data
           2: Processed
           3: Filtered
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
         
     Outputs
     ---------
@@ -278,12 +1696,10 @@ def getFlySpecLast(channel, starttime, timezone='utc', downsample='none', dsint=
         List of data
         
     '''
-    payload = {'channel': channel, 'starttime': starttime, 'timezone': timezone, 'downsample': downsample, 'dsint': 10, 'series': series, 'rank': rank}
-    req = requests.get('http://%s/api/flyspec' % (config['host']), params=payload)
-    date, datenum, data = parseJson(req, channel, series)
+    date, datenum, data = fetch('flyspec', channel, starttime, series=series, timezone=timezone, downsample=downsample, dsint=dsint, rank=rank, fast=fast)
     return date, datenum, data
     
-def getStrainLast(channel, starttime, timezone='utc', debias='none', series='dt01'):
+def getStrainLast(channel, starttime, timezone='utc', debias='none', series='dt01', fast=False):
     '''
     Gets Strain data from REST interface for the last X time increment.
     
@@ -313,6 +1729,9 @@ def getStrainLast(channel, starttime, timezone='utc', debias='none', series='dt0
         should other timezones, but I don't know for sure
     debias: string
         Remove mean?  Can be 'none' or 'mean'.  Defaults to 'none'.  
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
         
     Outputs
     ---------
@@ -324,12 +1743,10 @@ def getStrainLast(channel, starttime, timezone='utc', debias='none', series='dt0
         List of data
         
     '''    
-    payload = {'channel': channel, 'starttime': starttime, 'timezone': timezone, 'debias': debias, 'series': series}
-    req = requests.get('http://%s/api/strain' % (config['host']), params=payload)
-    date, datenum, data = parseJson(req, channel, series)
+    date, datenum, data = fetch('strain', channel, starttime, series=series, timezone=timezone, debias=debias, fast=fast)
     return date, datenum, data
     
-def getGPSLengthLast(channel, baseline, starttime, timezone='utc', dsint=10):
+def getGPSLengthLast(channel, baseline, starttime, timezone='utc', dsint=10, fast=False):
     '''
     Gets GPS length data from REST interface for the last X time increment.
     
@@ -355,6 +1772,9 @@ def getGPSLengthLast(channel, baseline, starttime, timezone='utc', dsint=10):
     dsint: integer
         factor to downsample by.  for example, as dsint of 10 on a 60 sec/sample
         data will result in 600 sec/sample data (1 min to 10 min)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
      
     Outputs
     ---------
@@ -367,13 +1787,10 @@ def getGPSLengthLast(channel, baseline, starttime, timezone='utc', dsint=10):
         
     '''    
     
-    series = 'length'
-    payload = {'channel': channel, 'baseline': baseline, 'starttime': starttime, 'timezone': timezone, 'dsint': 10, 'series': series}
-    req = requests.get('http://%s/api/gps' % (config['host']), params=payload)    
-    date, datenum, data = parseJson(req, channel, series)
+    date, datenum, data = fetch('gps', channel, starttime, timezone=timezone, baseline=baseline, dsint=dsint, fast=fast)
     return date, datenum, data
     
-def getRTNetLast(channel, starttime, timezone='utc', series='up', rank=4):
+def getRTNetLast(channel, starttime, timezone='utc', series='up', rank=4, fast=False):
     '''
     Gets GPS RTNet data from REST interface for the last X time interval.
     
@@ -396,9 +1813,13 @@ def getRTNetLast(channel, starttime, timezone='utc', series='up', rank=4):
         timezone for the data.  default is 'utc'. 'hst' is also accepted, as
         should other timezones, but I don't know for sure  
     series: string
-        data that is to be requested.  one series at a time (ex. "north" or "up", not "east,up")
+        data that is to be requested.  one series at a time (ex. "north" or "up", not "east,up").  see
+        fetchSeries for several at once
     rank: int
     	the rank of data to grab (see valve, default is 4)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
      
     Outputs
     ---------
@@ -411,12 +1832,10 @@ def getRTNetLast(channel, starttime, timezone='utc', series='up', rank=4):
         
     '''    
     
-    payload = {'channel': channel, 'starttime': starttime, 'timezone': timezone, 'rank': rank, 'series': series}
-    req = requests.get('http://%s/api/rtnet' % (config['host']), params=payload)    
-    date, datenum, data = parseJson(req, channel, series)
+    date, datenum, data = fetch('rtnet', channel, starttime, series=series, timezone=timezone, rank=rank, fast=fast)
     return date, datenum, data
     
-def getTremorSpan(channel, starttime, endtime, timezone='utc'):
+def getTremorSpan(channel, starttime, endtime, timezone='utc', chunk=None, fast=False):
     '''
     Gets Trigger data from REST interface from starttime to endtime.
     
@@ -440,6 +1859,14 @@ def getTremorSpan(channel, starttime, endtime, timezone='utc'):
     timezone: string
         timezone for the data.  default is 'utc'. 'hst' is also accepted, as
         should other timezones, but I don't know for sure
+    chunk: int or string
+        split the request into windows of this many seconds, fetched in
+        parallel and stitched back together in order.  'auto' sizes the
+        windows from the dataset sample rate.  Only used when starttime and
+        endtime are both absolute.  default is None (one request)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
         
     Outputs
     ---------
@@ -451,12 +1878,10 @@ def getTremorSpan(channel, starttime, endtime, timezone='utc'):
         List of data
         
     '''
-    payload = {'channel': channel, 'starttime': starttime, 'endtime': endtime, 'timezone': timezone}
-    req = requests.get('http://%s/api/triggers' % (config['host']), params=payload)    
-    date, datenum, data = parseJson(req, channel, 'triggers')
+    date, datenum, data = fetch('triggers', channel, starttime, endtime, timezone=timezone, chunk=chunk, fast=fast)
     return date, datenum, data
     
-def getTiltSpan(channel, starttime, endtime, timezone='utc', downsample='none', dsint=10, series='radial', rank=1):
+def getTiltSpan(channel, starttime, endtime, timezone='utc', downsample='none', dsint=10, series='radial', rank=1, chunk=None, fast=False):
     '''
     Gets Tilt data from REST interface for the given time interval.
     
@@ -494,6 +1919,14 @@ def getTiltSpan(channel, starttime, endtime, timezone='utc', downsample='none',
         data will result in 600 sec/sample data (1 min to 10 min)
     rank: integer
     	which rank is used (1 is decimated data, 2 is raw data).  defaults to 2.
+    chunk: int or string
+        split the request into windows of this many seconds, fetched in
+        parallel and stitched back together in order.  'auto' sizes the
+        windows from the dataset sample rate.  Only used when starttime and
+        endtime are both absolute.  default is None (one request)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
         
     Outputs
     ---------
@@ -506,12 +1939,10 @@ def getTiltSpan(channel, starttime, endtime, timezone='utc', downsample='none',
         
     '''    
     
-    payload = {'channel': channel, 'starttime': starttime, 'endtime': endtime, 'timezone': timezone, 'downsample': downsample, 'dsint': dsint, 'series': series, 'rank': rank}
-    req = requests.get('http://%s/api/tilt' % (config['host']), params=payload)
-    date, datenum, data = parseJson(req, channel, series)
+    date, datenum, data = fetch('tilt', channel, starttime, endtime, series, timezone, chunk, fast, downsample=downsample, dsint=dsint, rank=rank)
     return date, datenum, data
     
-def getStrainSpan(channel, starttime, endtime, timezone='utc', debias='none', series='dt01'):
+def getStrainSpan(channel, starttime, endtime, timezone='utc', debias='none', series='dt01', chunk=None, fast=False):
     '''
     Gets Strain data from REST interface for given time interval.
     
@@ -542,6 +1973,14 @@ def getStrainSpan(channel, starttime, endtime, timezone='utc', debias='none', se
         should other timezones, but I don't know for sure
     debias: string
         Remove mean?  Can be 'none' or 'mean'.  Defaults to 'none'.  
+    chunk: int or string
+        split the request into windows of this many seconds, fetched in
+        parallel and stitched back together in order.  'auto' sizes the
+        windows from the dataset sample rate.  Only used when starttime and
+        endtime are both absolute.  default is None (one request)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
         
     Outputs
     ---------
@@ -554,12 +1993,10 @@ def getStrainSpan(channel, starttime, endtime, timezone='utc', debias='none', se
         
     '''    
     
-    payload = {'channel': channel, 'starttime': starttime, 'endtime': endtime, 'timezone': timezone, 'debias': debias, 'series': series}
-    req = requests.get('http://%s/api/strain' % (config['host']), params=payload)
-    date, datenum, data = parseJson(req, channel, series)
+    date, datenum, data = fetch('strain', channel, starttime, endtime, series, timezone, chunk, fast, debias=debias)
     return date, datenum, data
     
-def getFlySpecSpan(channel, starttime, endtime, timezone='utc', downsample='none', dsint=10, series='bstflux', rank=2):
+def getFlySpecSpan(channel, starttime, endtime, timezone='utc', downsample='none', dsint=10, series='bstflux', rank=2, chunk=None, fast=False):
     '''
     Gets FlySpec data from REST interface for the given time interval.
     
@@ -601,6 +2038,14 @@ def getFlySpecSpan(channel, starttime, endtime, timezone='utc', downsample='none
           1: Raw Data
           2: Processed
           3: Filtered     
+    chunk: int or string
+        split the request into windows of this many seconds, fetched in
+        parallel and stitched back together in order.  'auto' sizes the
+        windows from the dataset sample rate.  Only used when starttime and
+        endtime are both absolute.  default is None (one request)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
      
     Outputs
     ---------
@@ -613,12 +2058,10 @@ def getFlySpecSpan(channel, starttime, endtime, timezone='utc', downsample='none
         
     '''    
     
-    payload = {'channel': channel, 'starttime': starttime, 'endtime': endtime, 'timezone': timezone, 'downsample': downsample, 'dsint': 10, 'series': series, 'rank': rank}
-    req = requests.get('http://%s/api/flyspec' % (config['host']), params=payload)    
-    date, datenum, data = parseJson(req, channel, series)
+    date, datenum, data = fetch('flyspec', channel, starttime, endtime, series, timezone, chunk, fast, downsample=downsample, dsint=dsint, rank=rank)
     return date, datenum, data
     
-def getGPSLengthSpan(channel, baseline, starttime, endtime, timezone='utc', dsint=10):
+def getGPSLengthSpan(channel, baseline, starttime, endtime, timezone='utc', dsint=10, chunk=None, fast=False):
     '''
     Gets GPS length data from REST interface for the given start time and stop time.
     
@@ -647,6 +2090,14 @@ def getGPSLengthSpan(channel, baseline, starttime, endtime, timezone='utc', dsin
     dsint: integer
         factor to downsample by.  for example, as dsint of 10 on a 60 sec/sample
         data will result in 600 sec/sample data (1 min to 10 min)
+    chunk: int or string
+        split the request into windows of this many seconds, fetched in
+        parallel and stitched back together in order.  'auto' sizes the
+        windows from the dataset sample rate.  Only used when starttime and
+        endtime are both absolute.  default is None (one request)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
      
     Outputs
     ---------
@@ -659,13 +2110,10 @@ def getGPSLengthSpan(channel, baseline, starttime, endtime, timezone='utc', dsin
         
     '''    
     
-    series = 'length'
-    payload = {'channel': channel, 'baseline': baseline, 'starttime': starttime, 'endtime': endtime, 'timezone': timezone, 'dsint': 10, 'series': series}
-    req = requests.get('http://%s/api/gps' % (config['host']), params=payload)    
-    date, datenum, data = parseJson(req, channel, series)
+    date, datenum, data = fetch('gps', channel, starttime, endtime, timezone=timezone, chunk=chunk, fast=fast, baseline=baseline, dsint=dsint)
     return date, datenum, data
     
-def getRTNetSpan(channel, starttime, endtime, timezone='utc', series='up', rank=4):
+def getRTNetSpan(channel, starttime, endtime, timezone='utc', series='up', rank=4, chunk=None, fast=False):
     '''
     Gets GPS RTNet data from REST interface for the given start time and stop time.
     
@@ -690,9 +2138,18 @@ def getRTNetSpan(channel, starttime, endtime, timezone='utc', series='up', rank=
         timezone for the data.  default is 'utc'. 'hst' is also accepted, as
         should other timezones, but I don't know for sure  
     series: string
-        data that is to be requested.  one series at a time (ex. "north" or "up", not "east,up")
+        data that is to be requested.  one series at a time (ex. "north" or "up", not "east,up").  see
+        fetchSeries for several at once
     rank: int
     	the rank of data to grab (see valve, default is 4)
+    chunk: int or string
+        split the request into windows of this many seconds, fetched in
+        parallel and stitched back together in order.  'auto' sizes the
+        windows from the dataset sample rate.  Only used when starttime and
+        endtime are both absolute.  default is None (one request)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
      
     Outputs
     ---------
@@ -705,12 +2162,10 @@ def getRTNetSpan(channel, starttime, endtime, timezone='utc', series='up', rank=
         
     '''    
     
-    payload = {'channel': channel, 'starttime': starttime, 'endtime': endtime, 'timezone': timezone, 'rank': rank, 'series': series}
-    req = requests.get('http://%s/api/rtnet' % (config['host']), params=payload)    
-    date, datenum, data = parseJson(req, channel, series)
+    date, datenum, data = fetch('rtnet', channel, starttime, endtime, series, timezone, chunk, fast, rank=rank)
     return date, datenum, data
 
-def getRsamSpan(channel, starttime, endtime, timezone='utc', downsample='none', dsint=10):
+def getRsamSpan(channel, starttime, endtime, timezone='utc', downsample='none', dsint=10, chunk=None, fast=False):
     '''
     Gets RSAM data from REST interface for a given start and stop time.
     
@@ -738,6 +2193,14 @@ def getRsamSpan(channel, starttime, endtime, timezone='utc', downsample='none',
     dsint: integer
         factor to downsample by.  for example, as dsint of 10 on a 60 sec/sample
         data will result in 600 sec/sample data (1 min to 10 min)
+    chunk: int or string
+        split the request into windows of this many seconds, fetched in
+        parallel and stitched back together in order.  'auto' sizes the
+        windows from the dataset sample rate.  Only used when starttime and
+        endtime are both absolute.  default is None (one request)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
         
     Outputs
     ---------
@@ -749,12 +2212,10 @@ def getRsamSpan(channel, starttime, endtime, timezone='utc', downsample='none',
         List of data
         
     '''
-    payload = {'channel': channel, 'starttime': starttime, 'endtime': endtime, 'timezone': timezone, 'downsample': downsample, 'dsint': 10}
-    req = requests.get('http://%s/api/rsam' % (config['host']), params=payload)
-    date, datenum, data = parseJson(req, channel, 'rsam')
+    date, datenum, data = fetch('rsam', channel, starttime, endtime, timezone=timezone, chunk=chunk, fast=fast, downsample=downsample, dsint=dsint)
     return date, datenum, data
 
-def getTriggersSpan(channel, starttime, endtime, timezone='utc'):
+def getTriggersSpan(channel, starttime, endtime, timezone='utc', chunk=None, fast=False):
     '''
     Gets trigger data from REST interface for a given start and stop time.
     
@@ -777,6 +2238,14 @@ def getTriggersSpan(channel, starttime, endtime, timezone='utc'):
     timezone: string
         timezone for the data.  default is 'utc'. 'hst' is also accepted, as
         should other timezones, but I don't know for sure
+    chunk: int or string
+        split the request into windows of this many seconds, fetched in
+        parallel and stitched back together in order.  'auto' sizes the
+        windows from the dataset sample rate.  Only used when starttime and
+        endtime are both absolute.  default is None (one request)
+    fast: boolean
+        If true, return numpy arrays of epoch seconds, datenums and data
+        instead of lists (see parseJson).  default is False
     
         
     Outputs
@@ -789,61 +2258,671 @@ def getTriggersSpan(channel, starttime, endtime, timezone='utc'):
         List of data
         
     '''
-    payload = {'channel': channel, 'starttime': starttime, 'endtime': endtime, 'timezone': timezone}
-    req = requests.get('http://%s/api/triggers' % (config['host']), params=payload)
-    date, datenum, data = parseJson(req, channel, 'triggers')
+    date, datenum, data = fetch('triggers', channel, starttime, endtime, timezone=timezone, chunk=chunk, fast=fast)
     return date, datenum, data
 
+def specKey(spec):
+    '''
+    Returns a hashable key for a fetchMany spec, with the options dict turned
+    into a sorted tuple of (key, value) pairs and lists (ex. a list of
+    series) into tuples.
+    '''
+    def hashable(value):
+        if isinstance(value, dict):
+            return tuple(sorted((k, hashable(v)) for k, v in value.items()))
+        if isinstance(value, (list, tuple)):
+            return tuple(hashable(v) for v in value)
+        return value
 
-def parseJson(toParse, channel, series):
+    dataset, channel, series, starttime, endtime, options = spec
+    return (dataset, channel, hashable(series), starttime, endtime, hashable(options or {}))
+
+def fetchSpec(spec):
     '''
-    Parses JSON embedded within requests structure.
-    
+    Runs a single fetchMany spec through fetch().
+    '''
+    dataset, channel, series, starttime, endtime, options = spec
+    return fetch(dataset, channel, starttime, endtime, series, **(options or {}))
+
+def fetchMany(specs, max_workers=8):
+    '''
+    Fetches many channels concurrently on a bounded thread pool.  All workers
+    share the module level client, so they share its connection pool; set
+    poolSize in configureClient() to at least max_workers to keep every
+    worker on a kept-alive socket.
+
     Parameters
     ----------
-    toParse: requests object
-        
-    channel: string
-        string of SCNL or something similar to identify the object
-    series: string
-        label of the data in the json object
-        'rsam' for rsam data
+    specs: list
+        list of (dataset, channel, series, starttime, endtime, options) tuples.
+        dataset is one of 'rsam', 'triggers', 'tilt', 'flyspec', 'strain',
+        'gps' or 'rtnet'.  series is ignored for rsam, triggers and gps (use
+        None).  endtime of None fetches relative to now like the get*Last
+        functions, otherwise a Span is fetched.  options is a dict of extra
+        keyword arguments for fetch() (ex. {'rank': 2} or
+        {'baseline': 'MLSP'}), or None.
+    max_workers: int
+        number of requests in flight at once.  default is 8
+
+    Outputs
+    ---------
+    results: dict
+        (date, datenum, data) of each successful spec, keyed by specKey(spec)
+    errors: dict
+        exception raised by each failed spec, keyed by specKey(spec)
+    '''
+    from multiprocessing.pool import ThreadPool
+
+    def run(spec):
+        key = specKey(spec)
+        try:
+            return key, fetchSpec(spec), None
+        except Exception as e:
+            return key, None, e
+
+    results = {}
+    errors = {}
+    if len(specs) == 0:
+        return results, errors
+    pool = ThreadPool(min(max_workers, len(specs)))
+    try:
+        for key, result, error in pool.imap_unordered(run, specs):
+            if error is None:
+                results[key] = result
+            else:
+                errors[key] = error
+    finally:
+        pool.close()
+        pool.join()
+    return results, errors
+
+class Follower(object):
+    '''
+    Follows one channel in near real time.  The first poll() fetches the
+    starttime window; after that each poll() only asks for data after the
+    last sample already received and appends the new samples to a ring
+    buffer of the most recent bufferLength samples.
+
+    Parameters
+    ----------
+    dataset: string
+        'rsam', 'triggers', 'tilt', 'flyspec', 'strain', 'gps' or 'rtnet'
+    channel: string
+        channel name (see the get* functions)
+    series: string
+        series name, ignored for rsam, triggers and gps.  default is None
+    starttime: string
+        window fetched by the first poll, relative to now.  default is '-1h'
+    bufferLength: int
+        number of samples kept in the ring buffer.  default is 86400
+    callback: function
+        called as callback(epoch, data) with the new samples of each poll
+        that returned any.  default is None
+    timezone: string
+        timezone for the data.  default is 'utc'
+    options: dict
+        extra request parameters (ex. {'rank': 2} or {'baseline': 'MLSP'})
+
+    Example
+    ---------
+    follower = Follower('rsam', 'NPT$HWZ$HV', starttime='-1h')
+    for epoch, data in follower.follow(interval=60):
+        ...
+    '''
+    def __init__(self, dataset, channel, series=None, starttime='-1h', bufferLength=86400,
+                 callback=None, timezone='utc', options=None):
+        import numpy
+        self.dataset = dataset
+        self.channel = channel
+        self.series = series
+        self.starttime = starttime
+        self.callback = callback
+        self.timezone = timezone
+        self.options = options
+        self.lastSample = None
+        self.epoch = numpy.zeros(bufferLength)
+        self.data = numpy.zeros(bufferLength)
+        self.head = 0    # next slot to write
+        self.count = 0   # samples in the buffer
+
+    def poll(self):
+        '''
+        Fetches the samples after the last one received, adds them to the
+        buffer and returns them as (epoch, data) arrays.
+        '''
+        from datetime import datetime
+        if self.lastSample is None:
+            starttime = self.starttime
+        else:
+            starttime = datetime.utcfromtimestamp(int(self.lastSample)).strftime('%Y%m%d%H%M%S')
+        payload = buildPayload(self.dataset, self.channel, self.series, starttime,
+                               timezone=self.timezone, options=self.options)
+        epoch, datenum, data = fetchPayload(self.dataset, payload, self.channel,
+                                            seriesKey(self.dataset, self.series), True)
+        if self.lastSample is not None:
+            keep = epoch > self.lastSample
+            epoch, data = epoch[keep], data[keep]
+        if len(epoch) == 0:
+            return epoch, data
+        self.lastSample = epoch[-1]
+        self.append(epoch, data)
+        if self.callback is not None:
+            self.callback(epoch, data)
+        return epoch, data
+
+    def append(self, epoch, data):
+        import numpy
+        size = len(self.epoch)
+        if len(epoch) >= size:
+            epoch, data = epoch[-size:], data[-size:]
+        slots = (self.head + numpy.arange(len(epoch))) % size
+        self.epoch[slots] = epoch
+        self.data[slots] = data
+        self.head = (self.head + len(epoch)) % size
+        self.count = min(self.count + len(epoch), size)
+
+    def buffer(self):
+        '''
+        Returns copies of the buffered (epoch, data) in time order.
+        '''
+        import numpy
+        order = (self.head - self.count + numpy.arange(self.count)) % len(self.epoch)
+        return self.epoch[order], self.data[order]
+
+    def follow(self, interval=60, polls=None):
+        '''
+        Generator that polls every interval seconds, yielding the (epoch,
+        data) of each poll that returned new samples.  Stops after polls
+        polls if given.
+        '''
+        done = 0
+        while polls is None or done < polls:
+            started = time.time()
+            epoch, data = self.poll()
+            done += 1
+            if len(epoch) > 0:
+                yield epoch, data
+            if polls is None or done < polls:
+                time.sleep(max(0, interval - (time.time() - started)))
+
+
+class AsyncRequest(asyncore.dispatcher):
+    '''
+    One non-blocking HTTP GET driven by the AsyncFetcher event loop.
+    '''
+    def __init__(self, fetcher, key, address, hostHeader, path, socketMap):
+        asyncore.dispatcher.__init__(self, map=socketMap)
+        self.fetcher = fetcher
+        self.key = key
+        self.outbuf = ('GET %s HTTP/1.0\r\nHost: %s\r\nAccept-Encoding: identity\r\n'
+                       'Connection: close\r\n\r\n' % (path, hostHeader))
+        self.inbuf = []
+        self.error = None
+        self.finished = False
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect(address)
+
+    def handle_connect(self):
+        pass
+
+    def writable(self):
+        return len(self.outbuf) > 0
+
+    def handle_write(self):
+        sent = self.send(self.outbuf)
+        self.outbuf = self.outbuf[sent:]
+
+    def handle_read(self):
+        self.inbuf.append(self.recv(65536))
+
+    def handle_close(self):
+        self.finish()
+
+    def handle_error(self):
+        import sys
+        self.error = sys.exc_info()[1]
+        self.finish()
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.close()
+        self.fetcher.complete(self, ''.join(self.inbuf))
+
+class AsyncFetcher(object):
+    '''
+    Fetches many channels on a single thread using non-blocking sockets and
+    the asyncore event loop, so thousands of requests can be in flight
+    without a thread (or an executor) per request.  Requests are queued with
+    fetch() and run with run(); at most maxInFlight sockets are open at once.
+    Responses are parsed with the same code as parseJson.
+
+    Each request uses its own connection (HTTP/1.0, Connection: close), so
+    use fetchMany when reusing pooled sockets matters more than the number
+    of requests in flight.
+
+    Parameters
+    ----------
+    maxInFlight: int
+        maximum number of open requests.  default is 100
+    timeout: float
+        seconds before an unfinished request is abandoned.  default is 120
+    fast: boolean
+        If true, results are numpy arrays (see parseJson).  default is False
+
+    Example
+    ---------
+    fetcher = AsyncFetcher(maxInFlight=200)
+    for chan in channels:
+        fetcher.fetch('rsam', chan, None, '201504150000', '201504152030')
+    results, errors = fetcher.run()
+    '''
+    def __init__(self, maxInFlight=100, timeout=120, fast=False):
+        from collections import deque
+        self.maxInFlight = maxInFlight
+        self.timeout = timeout
+        self.fast = fast
+        self.pending = deque()
+        self.socketMap = {}
+        self.active = {}
+        self.results = {}
+        self.errors = {}
+
+    def fetch(self, dataset, channel, series=None, starttime='-1h', endtime=None,
+              timezone='utc', options=None, callback=None):
+        '''
+        Queues a request.  Arguments are the same as a fetchMany spec, plus
+        timezone.  callback, if given, is called as callback(key, result,
+        error) when the request finishes.  Returns the result key, which is
+        specKey() of the equivalent fetchMany spec.
+        '''
+        key = specKey((dataset, channel, series, starttime, endtime, options))
+        payload = buildPayload(dataset, channel, series, starttime, endtime, timezone, options)
+        self.pending.append((key, dataset, channel, seriesKey(dataset, series), payload, callback))
+        return key
+
+    def start(self, item, address, hostHeader, basePath):
+        from urllib import urlencode
+        key, dataset, channel, series, payload, callback = item
+        path = '%s/api/%s?%s' % (basePath, datasets[dataset]['endpoint'], urlencode(payload))
+        try:
+            req = AsyncRequest(self, key, address, hostHeader, path, self.socketMap)
+        except Exception as e:
+            self.done(key, callback, None, e)
+            return
+        req.item = item
+        req.started = time.time()
+        self.active[req] = item
+
+    def complete(self, req, raw):
+        item = self.active.pop(req, None)
+        if item is None:
+            return
+        key, dataset, channel, series, payload, callback = item
+        if req.error is not None:
+            self.done(key, callback, None, req.error)
+            return
+        try:
+            head, body = raw.split('\r\n\r\n', 1)
+            status = int(head.split(None, 2)[1])
+            if status != 200:
+                raise IOError('HTTP %d from Valve for %s' % (status, channel))
+            result = parseRecords(json.loads(body), channel, series, self.fast)
+        except Exception as e:
+            self.done(key, callback, None, e)
+            return
+        self.done(key, callback, result, None)
+
+    def done(self, key, callback, result, error):
+        if error is None:
+            self.results[key] = result
+        else:
+            self.errors[key] = error
+        if callback is not None:
+            callback(key, result, error)
+
+    def run(self):
+        '''
+        Runs the event loop until every queued request has finished.
+
+        Outputs
+        ---------
+        results: dict
+            (date, datenum, data) of each successful request, keyed by specKey
+        errors: dict
+            exception raised by each failed request, keyed by specKey
+        '''
+        host = client.hostName()
+        basePath = ''
+        if '://' in host:
+            host = host.split('://', 1)[1]
+        if '/' in host:
+            host, basePath = host.split('/', 1)
+            basePath = '/' + basePath.rstrip('/')
+        name, port = (host.rsplit(':', 1) + ['80'])[:2]
+        address = (socket.gethostbyname(name), int(port))
+        while self.pending or self.active:
+            while self.pending and len(self.active) < self.maxInFlight:
+                self.start(self.pending.popleft(), address, host, basePath)
+            if self.socketMap:
+                asyncore.loop(timeout=0.1, map=self.socketMap, count=1)
+            now = time.time()
+            for req in list(self.active):
+                if now - req.started > self.timeout:
+                    req.error = IOError('Timed out after %s seconds' % self.timeout)
+                    req.finish()
+        return self.results, self.errors
+
+
+def parseJson(toParse, channel, series, fast=False, dataset=None):
+    '''
+    Parses JSON embedded within requests structure.
+    
+    Parameters
+    ----------
+    toParse: requests object
+        
+    channel: string
+        string of SCNL or something similar to identify the object
+    series: string
+        label of the data in the json object
+        'rsam' for rsam data
         'radial', 'tangential', 'east', 'north', 'rainfall' for tilt data
         'bstflux', 'bstfluxmean', 'bstfluxmeanstdev', 'ps' or 'pd' for flyspec data
+    fast: boolean
+        If true, convert all samples at once into numpy arrays instead of
+        building a UTCDateTime per sample.  Use epoch2utc to get the
+        UTCDateTime list afterwards if it is needed.  default is False
+    dataset: string
+        dataset name the stage Metrics are recorded under.  default is None
         
     Outputs
     ---------
     date: list
         Times of individual samples in UTCDateTime
+        (fast: float64 array of epoch seconds)
     datenum: list
         Times of individual samples in matplotlib datenum format
+        (fast: float64 array)
     data: list
         Data
+        (fast: float64 array, missing values are NaN)
         
     '''
+    timer = stage('json', dataset)
+    jj = toParse.json()
+    timer.done()
+    return parseRecords(jj, channel, series, fast, dataset)
+
+def parseRecords(jj, channel, series, fast=False, dataset=None):
+    '''
+    Parses the records of an already decoded Valve JSON response.  Same
+    inputs and outputs as parseJson, except jj is the decoded dict.
+    '''
+    timer = stage('records', dataset)
+    if fast:
+        import numpy
+        records = jj['records'][channel]
+        epoch = toEpoch([samp['date'] for samp in records])
+        if isinstance(series, basestring):
+            data = numpy.array([samp[series] for samp in records], dtype='float64')
+        else:
+            data = numpy.array([[samp[c] for c in series] for samp in records], dtype='float64')
+            data = data.reshape(-1, len(series))
+        timer.done(records=len(data), nbytes=3 * data.nbytes)
+        return epoch, epoch2num(epoch), data
     from obspy import UTCDateTime
     import matplotlib.dates as dates
     date = []
     datenum = []
     data = []
-    jj = toParse.json()
     for samp in jj['records'][channel]:
         d = samp['date']
         dd = UTCDateTime(d)
         date.append(dd)
 #        j2k_to_date(date, timezone).strftime('%Y-%m-%d %H:%M:%S.%f')
         datenum.append(dates.date2num(dd.datetime))
-        data.append(samp[series])
+        data.append(samp[series] if isinstance(series, basestring) else [samp[c] for c in series])
+    timer.done(records=len(data))
     return date, datenum, data
 
+def parseJsonStream(toParse, channel, series, chunkSize=65536, batchSize=10000, dataset=None):
+    '''
+    Parses a Valve JSON response incrementally while it downloads, without
+    ever building the full dict.  Records for the channel are decoded one at
+    a time and converted in batches into growable float64 arrays, so memory
+    stays close to the size of the output arrays.
+
+    Parameters
+    ----------
+    toParse: requests object
+        response requested with stream=True
+    channel: string
+        string of SCNL or something similar to identify the object
+    series: string or list
+        label of the data in the json object (see parseJson).  A list of
+        labels reads them all from each record into a 2-D data array with
+        one column per label
+    chunkSize: int
+        bytes read from the response at a time.  default is 65536
+    batchSize: int
+        records converted to arrays at a time.  default is 10000
+    dataset: string
+        dataset name the stage Metrics are recorded under.  default is None
+
+    Outputs
+    ---------
+    Same as parseJson with fast=True
+    '''
+    import numpy
+    from array import array
+    decoder = json.JSONDecoder()
+    key = json.dumps(channel)
+    epoch = array('d')
+    values = array('d')
+    dates = []
+    data = []
+
+    columns = None if isinstance(series, basestring) else list(series)
+
+    def flush():
+        if dates:
+            epoch.extend(toEpoch(dates))
+            values.extend(numpy.array(data, dtype='float64').ravel())
+            del dates[:]
+            del data[:]
+
+    timer = stage('parseJsonStream', dataset)
+    received = 0
+    buf = ''
+    pos = 0
+    state = 'records'  # then 'channel', 'list', 'items', 'done'
+    for piece in toParse.iter_content(chunkSize):
+        received += len(piece)
+        buf = buf[pos:] + piece
+        pos = 0
+        while state != 'done':
+            if state == 'records':
+                found = buf.find('"records"')
+                if found < 0:
+                    pos = max(len(buf) - 9, 0)
+                    break
+                pos = found + 9
+                state = 'channel'
+            elif state == 'channel':
+                found = buf.find(key, pos)
+                if found < 0:
+                    pos = max(len(buf) - len(key), pos)
+                    break
+                pos = found + len(key)
+                state = 'list'
+            elif state == 'list':
+                found = buf.find('[', pos)
+                if found < 0:
+                    break
+                pos = found + 1
+                state = 'items'
+            else:
+                while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos >= len(buf):
+                    break
+                if buf[pos] == ']':
+                    state = 'done'
+                    break
+                try:
+                    samp, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    break   # record is split across reads
+                pos = end
+                dates.append(samp['date'])
+                if columns is None:
+                    data.append(samp[series])
+                else:
+                    data.append([samp[c] for c in columns])
+                if len(dates) >= batchSize:
+                    flush()
+        if state == 'done':
+            break
+    if state != 'done':
+        checkLength(toParse)
+        raise KeyError(channel)
+    flush()
+    epoch = numpy.frombuffer(epoch, dtype='float64') if len(epoch) else numpy.zeros(0)
+    values = numpy.frombuffer(values, dtype='float64') if len(values) else numpy.zeros(0)
+    if columns is not None:
+        values = values.reshape(-1, len(columns))
+    timer.done(bytes=wireBytes(toParse, received), records=len(epoch),
+               nbytes=2 * epoch.nbytes + values.nbytes)
+    return epoch, epoch2num(epoch), values
+
+def parseCsvStream(toParse, series, chunkSize=65536, dataset=None):
+    '''
+    Parses a csv response (a header line, then one line per sample with the
+    date first) while it downloads.  Each read's complete lines are split
+    into columns with numpy and added to growable float64 arrays, so memory
+    stays close to the size of the output arrays, as in parseJsonStream.
+
+    Parameters
+    ----------
+    toParse: requests object
+        response with a csv body, requested with stream=True
+    series: string or list
+        label(s) of the data columns to read (see parseJsonStream)
+    chunkSize: int
+        bytes read from the response at a time.  default is 65536
+    dataset: string
+        dataset name the stage Metrics are recorded under.  default is None
+
+    Outputs
+    ---------
+    Same as parseJson with fast=True
+    '''
+    import numpy
+    from array import array
+    timer = stage('parseCsvStream', dataset)
+    columns = [series] if isinstance(series, basestring) else list(series)
+    epoch = array('d')
+    values = array('d')
+    names = None
+    usecols = None
+    received = 0
+    buf = ''
+    for piece in toParse.iter_content(chunkSize):
+        received += len(piece)
+        buf += piece.replace('\r', '')
+        end = buf.rfind('\n')
+        if end < 0:
+            continue
+        lines, buf = buf[:end], buf[end + 1:]
+        if names is None:
+            header, _, lines = lines.partition('\n')
+            names = [n.strip().strip('"') for n in header.split(',')]
+            missing = [c for c in columns if c not in names]
+            if missing:
+                raise KeyError(missing[0])
+            usecols = [names.index(c) for c in columns]
+        lines = lines.strip('\n')
+        if not lines:
+            continue
+        # one string array of the block's fields, split into columns
+        fields = numpy.array(lines.replace('\n', ',').split(','), dtype='S').reshape(-1, len(names))
+        epoch.extend(toEpoch(numpy.char.strip(fields[:, 0], '" ')))
+        block = fields[:, usecols]
+        block[(block == '') | (block == 'null')] = 'nan'
+        values.extend(block.astype('float64').ravel())
+    checkLength(toParse)
+    if buf.strip() and names is not None:
+        # last line without a newline
+        fields = [f.strip().strip('"') for f in buf.strip().split(',')]
+        epoch.extend(toEpoch(fields[:1]))
+        values.extend(float(fields[c]) if fields[c] not in ('', 'null') else float('nan') for c in usecols)
+    epoch = numpy.frombuffer(epoch, dtype='float64') if len(epoch) else numpy.zeros(0)
+    data = numpy.frombuffer(values, dtype='float64') if len(values) else numpy.zeros(0)
+    data = data.reshape(-1, len(columns))
+    if isinstance(series, basestring):
+        data = data[:, 0]
+    timer.done(bytes=wireBytes(toParse, received), records=len(epoch),
+               nbytes=2 * epoch.nbytes + data.nbytes)
+    return epoch, epoch2num(epoch), data
+
+def toEpoch(dates):
+    '''
+    Converts dates to a float64 array of epoch seconds in one vectorized
+    step.  dates can be valve date strings, numbers (already epoch seconds,
+    as UTCDateTime treats them), numpy datetime64 or UTCDateTime objects.
+    '''
+    import numpy
+    if len(dates) == 0:
+        return numpy.zeros(0)
+    dates = numpy.asarray(dates)
+    if dates.dtype.kind in 'iuf':
+        return dates.astype('float64')
+    if dates.dtype.kind == 'M':
+        return dates.astype('datetime64[us]').astype('int64') / 1e6
+    if dates.dtype.kind in 'SU':
+        try:
+            stamps = numpy.char.rstrip(dates, 'Z').astype('datetime64[us]')
+            return stamps.astype('int64') / 1e6
+        except ValueError:
+            pass
+    stamp = getattr(dates[0], 'timestamp', None)
+    if stamp is not None and not callable(stamp):   # UTCDateTime
+        return numpy.array([d.timestamp for d in dates], dtype='float64')
+    from obspy import UTCDateTime
+    return numpy.array([UTCDateTime(d).timestamp for d in dates], dtype='float64')
+
+# matplotlib datenum of 1970-01-01 (days since 0001-01-01 plus one, the
+# only datenum epoch of the matplotlib releases for Python 2), so fast
+# fetches never have to import matplotlib
+epochDatenum = 719163.0
+
+def epoch2num(epoch):
+    '''
+    Converts epoch seconds to matplotlib datenums with one array operation.
+    '''
+    import numpy
+    return numpy.asarray(epoch, dtype='float64') / 86400.0 + epochDatenum
+
+def epoch2utc(epoch):
+    '''
+    Converts epoch seconds to a list of UTCDateTime objects, for code that
+    needs the date list of the non-fast get* outputs.
+    '''
+    from obspy import UTCDateTime
+    return [UTCDateTime(e) for e in epoch]
+
 def detectGap(date, gapThres):
     """
     Detects gap in a date vector based on the user defined threshold.
-    
+    Gap information is reported through the 'valveData' logger; use
+    findGaps for the gap times and lengths.
+
     Parameters
     ----------
     date: list
-        Dates in UTCDateTime format to detect gaps within.
+        Dates in UTCDateTime format (or epoch seconds) to detect gaps within.
     gapThres: float
         Threshold in seconds over which to detect a gap.
     
@@ -852,17 +2931,54 @@ def detectGap(date, gapThres):
     gapIndex: list
         Indicies of gaps
     """
-    from numpy import diff, where, array
-    datediff = array(diff(date))
-    gapIndex = where(datediff>gapThres)
-    # Print gap information to screen (or somewhere)
-    print '%d gaps found of greater than %s seconds' % (len(gapIndex[0]),gapThres)
-    for i in gapIndex[0]:
-        gapLength = date[i+1]-date[i]
-        print 'Gap: %0.4f seconds at %s' % (gapLength, date[i].strftime('%Y-%m-%d_%H:%M:%S'))
-    return gapIndex[0]
-    
-def splitData(date,data,gapIndex,delta=60,resample=True):
+    return findGaps(date, gapThres)['index']
+
+gapDtype = [('index', 'int64'), ('start', 'float64'), ('end', 'float64'), ('length', 'float64')]
+
+def findGaps(date, gapThres, level=logging.INFO, gapLevel=logging.DEBUG):
+    """
+    Detects gaps in a date vector with array operations only.
+
+    Parameters
+    ----------
+    date: array or list
+        Dates to detect gaps within, as epoch seconds (ex. the fast output
+        of the get* functions), numpy datetime64 or UTCDateTime.
+    gapThres: float
+        Threshold in seconds over which to detect a gap.
+    level: int
+        logging level of the summary line.  default is logging.INFO
+    gapLevel: int
+        logging level of the line written for each gap.  The lines are only
+        built when that level is enabled.  default is logging.DEBUG
+
+    Outputs
+    ---------
+    gaps: numpy structured array
+        One row per gap with fields 'index' (index of the last sample before
+        the gap), 'start' and 'end' (epoch seconds of the samples either side
+        of the gap) and 'length' (seconds)
+    """
+    import numpy
+    timer = stage('findGaps')
+    epoch = toEpoch(date)
+    datediff = numpy.diff(epoch)
+    index = numpy.flatnonzero(datediff > gapThres)
+    gaps = numpy.empty(len(index), dtype=gapDtype)
+    gaps['index'] = index
+    gaps['start'] = epoch[index]
+    gaps['end'] = epoch[index + 1]
+    gaps['length'] = datediff[index]
+    logger.log(level, '%d gaps found of greater than %s seconds', len(gaps), gapThres)
+    if len(gaps) > 0 and logger.isEnabledFor(gapLevel):
+        from datetime import datetime
+        for gap in gaps:
+            logger.log(gapLevel, 'Gap: %0.4f seconds at %s', gap['length'],
+                       datetime.utcfromtimestamp(gap['start']).strftime('%Y-%m-%d_%H:%M:%S'))
+    timer.done(records=len(epoch), nbytes=datediff.nbytes + gaps.nbytes)
+    return gaps
+
+def splitData(date,data,gapIndex,delta=60,resample=True,kernel='linear'):
     """
     Splits date and data based on gapIndex.  After data is split, it is
     resampled to create an even time series.
@@ -879,6 +2995,8 @@ def splitData(date,data,gapIndex,delta=60,resample=True):
         Number of seconds per sample
     resample: boolean
         If true, resample data to delta seconds per sample
+    kernel: string
+        Resampling kernel, see resampleSegment.  default is 'linear'
     
     Outputs
     ---------
@@ -889,82 +3007,182 @@ def splitData(date,data,gapIndex,delta=60,resample=True):
     """
     slicedData = []   # Stores a list of data without gaps
     slicedDates = []  # Stores a list of dates without gaps
-    import matplotlib.dates as md
-    from obspy import UTCDateTime
-    from datetime import timedelta
-    from numpy import interp
+    import numpy
 
     if len(data) == 0:
         return slicedDates, slicedData
-    
-    # Step through indices, assigning beginning and ending indexes, 
-    # and converting to time series
+    timer = stage('splitData')
     if resample == True:
-        numdelta = timedelta(seconds=delta)
-        print 'Resampling data to even spacing of %d seconds' % delta
-    for ind in range(len(gapIndex)):
-        if ind == 0:
-            startSamp = 0
-            endSamp = gapIndex[ind]+1
-        else:
-            startSamp = gapIndex[ind-1]+1
-            endSamp = gapIndex[ind]+1
-        if endSamp-startSamp <= 1:   # If only consists of one datapoint, don't save it
-            continue
-        # Now resample (if necessary)
+        logger.info('Resampling data to even spacing of %d seconds', delta)
+    bounds = segmentBounds(len(data), gapIndex)
+    segments = splitSegments(date, data, gapIndex, delta, resample, kernel)
+    for (startSamp, endSamp), (start, step, values) in zip(bounds, segments):
         if resample == True:
-            dnum = md.date2num(date[startSamp:endSamp])
-            dnumnew = md.drange(date[startSamp],date[endSamp-1], numdelta)
-            newdata = interp(dnumnew, dnum, data[startSamp:endSamp])
-            dvec = []
-            for d in dnumnew:
-                dvec.append(UTCDateTime(md.num2date(d)))
-            slicedData.append(newdata)
-            slicedDates.append(dvec)
+            slicedData.append(values)
+            slicedDates.append(epoch2utc(start + step * numpy.arange(len(values))))
         else:
-            #print 'Start Samp: %d' % startSamp
-            #print 'Start Date: %s' % date[startSamp]
-            #print 'End Samp: %d' % endSamp
-            #print 'End Date: %s' % date[endSamp]
-            #print 'nSamples: %d' % endSamp-startSamp
             slicedData.append(data[startSamp:endSamp])
             slicedDates.append(date[startSamp:endSamp])
-    if len(gapIndex) > 0:   # This loop gets entered if there is a gap
-        # Add last window of data
-        startSamp = gapIndex[-1]+1
-        datalen = len(data)-gapIndex[-1]
-        if datalen > 1:     # Check to make sure that last data segment is more than one sample
-            # Resample last window (if necessary)
-            if resample == True:
-                dnum = md.date2num(date[startSamp:-1])
-                dnumnew = md.drange(date[startSamp],date[-1], numdelta)
-                newdata = interp(dnumnew, dnum, data[startSamp:-1])
-                dvec = []
-                for d in dnumnew:
-                    dvec.append(UTCDateTime(md.num2date(d)))
-                slicedData.append(newdata)
-                slicedDates.append(dvec)
-            else:
-                slicedData.append(data[startSamp:-1])
-                slicedDates.append(date[startSamp:-1])
-    else:   # This is the loop for data with no gaps that needs to be resampled
-        if resample == True:
-            dnum = md.date2num(date)
-            dnumnew = md.drange(date[0],date[-1], numdelta)
-            newdata = interp(dnumnew, dnum, data)
-            dvec = []
-            for d in dnumnew:
-                dvec.append(UTCDateTime(md.num2date(d)))
-            slicedData.append(newdata)
-            slicedDates.append(dvec)
-        else:
-            slicedData.append(data)
-            slicedDates.append(date)
-        
-    
+    timer.done(records=len(data))
     return slicedDates, slicedData
+
+def segmentBounds(npts, gapIndex):
+    """
+    Returns (startSamp, endSamp) of each continuous segment between the
+    gaps in gapIndex, leaving out segments of a single sample.
+    """
+    import numpy
+    gapIndex = numpy.asarray(gapIndex, dtype='int64')
+    starts = numpy.concatenate(([0], gapIndex + 1))
+    ends = numpy.concatenate((gapIndex + 1, [npts]))
+    keep = ends - starts > 1
+    return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+def splitSegments(date, data, gapIndex, delta=60, resample=True, kernel='linear'):
+    """
+    Splits date and data based on gapIndex like splitData, working only on
+    numeric arrays: no per-sample objects are made, and without resampling
+    the segment data are views into data.
+
+    Parameters
+    ----------
+    date: array or list
+        Dates as epoch seconds (ex. the fast output of the get* functions),
+        numpy datetime64 or UTCDateTime.
+    data: array or list
+        Floats of data corresponding to the date.
+    gapIndex: array
+        Indicies of gaps (see detectGap or findGaps(...)['index'])
+    delta: float
+        Number of seconds per sample
+    resample: boolean
+        If true, resample each segment onto an even grid of
+        delta seconds, starting at the first sample of the segment
+    kernel: string
+        Resampling kernel, see resampleSegment.  default is 'linear'
+
+    Outputs
+    ---------
+    segments: list
+        list of (start, delta, data) tuples, one per continuous segment.
+        start is in epoch seconds.  Without resampling, delta is the spacing
+        of the first two samples of the segment.
+    """
+    import numpy
+    timer = stage('splitSegments')
+    epoch = toEpoch(date)
+    data = numpy.asarray(data, dtype='float64')
+    segments = []
+    for startSamp, endSamp in segmentBounds(len(data), gapIndex):
+        times = epoch[startSamp:endSamp]
+        values = data[startSamp:endSamp]
+        if resample:
+            segments.append((times[0], delta, resampleSegment(times, values, delta, kernel)))
+        else:
+            segments.append((times[0], times[1] - times[0], values))
+    timer.done(records=len(data), nbytes=sum(s[2].nbytes for s in segments))
+    return segments
+
+# Kernels accepted by resampleSegment
+kernels = ('linear', 'mean', 'median', 'last', 'decimate')
+
+def resampleSegment(times, values, delta, kernel='linear'):
+    """
+    Resamples one continuous segment onto an even grid of delta seconds
+    starting at times[0].  Every kernel is a vectorized pass over the
+    segment, so downsampling by large factors stays O(n).
+
+    Parameters
+    ----------
+    times: array
+        Epoch seconds of the samples, increasing
+    values: array
+        Float64 data of the samples
+    delta: float
+        Number of seconds per output sample
+    kernel: string
+        'linear': linear interpolation at each output time
+        'mean': mean of the samples in each delta long bin
+        'median': median of the samples in each bin
+        'last': last sample in each bin
+        'decimate': anti-alias FIR low-pass, then keep every q-th sample,
+            evaluated only at the kept samples (polyphase).  Needs delta to
+            be an integer multiple q of the input sample interval.
+        Bins start at the output sample time.  Empty bins of 'mean',
+        'median' and 'last' are filled by linear interpolation.
+
+    Outputs
+    ---------
+    data: array
+        Float64 data on the grid times[0] + delta * arange(len(data))
+    """
+    import numpy
+    npts = max(int(numpy.ceil((times[-1] - times[0]) / float(delta))), 1)
+    grid = times[0] + delta * numpy.arange(npts)
+    if kernel == 'linear':
+        return numpy.interp(grid, times, values)
+    if kernel == 'decimate':
+        return decimateSegment(times, values, delta, npts)
+    if kernel not in kernels:
+        raise ValueError('Unknown resampling kernel %r, use one of %s' % (kernel, ', '.join(kernels)))
+    bins = numpy.minimum(((times - times[0]) // delta).astype('int64'), npts - 1)
+    counts = numpy.bincount(bins, minlength=npts)
+    filled = counts > 0
+    out = numpy.empty(npts)
+    if kernel == 'mean':
+        sums = numpy.bincount(bins, weights=values, minlength=npts)
+        out[filled] = sums[filled] / counts[filled]
+    elif kernel == 'last':
+        # times are sorted, so bins are too: the last sample of a bin is
+        # where the bin number changes
+        lastSamp = numpy.flatnonzero(numpy.diff(bins)) if len(bins) > 1 else numpy.zeros(0, 'int64')
+        lastSamp = numpy.append(lastSamp, len(bins) - 1)
+        out[bins[lastSamp]] = values[lastSamp]
+    else:
+        order = numpy.lexsort((values, bins))
+        ordered = values[order]
+        offsets = numpy.cumsum(counts) - counts
+        c = counts[filled]
+        lo = offsets[filled] + (c - 1) // 2
+        hi = offsets[filled] + c // 2
+        out[filled] = 0.5 * (ordered[lo] + ordered[hi])
+    if not filled.all():
+        out[~filled] = numpy.interp(grid[~filled], grid[filled], out[filled])
+    return out
+
+def decimateSegment(times, values, delta, npts):
+    """
+    Anti-alias filters and decimates a segment to delta seconds per sample
+    (see resampleSegment).  The segment is first put on an even grid at its
+    own median sample interval, which must divide delta.
+    """
+    import numpy
+    from numpy.lib.stride_tricks import as_strided
+    step = numpy.median(numpy.diff(times))
+    q = int(round(delta / step))
+    if q < 1 or abs(q * step - delta) > 1e-6 * delta:
+        raise ValueError('decimate needs delta (%s) to be a multiple of the sample interval (%s)' % (delta, step))
+    nin = int(numpy.floor((times[-1] - times[0]) / step + 1e-9)) + 1
+    regular = numpy.interp(times[0] + step * numpy.arange(nin), times, values)
+    if q == 1:
+        return regular[:npts]
+    # Hamming windowed sinc low-pass with its cutoff at the output Nyquist
+    half = 8 * q
+    n = numpy.arange(-half, half + 1)
+    taps = numpy.sinc(n / float(q)) / q * numpy.hamming(len(n))
+    taps /= taps.sum()
+    padded = numpy.concatenate((numpy.repeat(regular[0], half), regular,
+                                numpy.repeat(regular[-1], half)))
+    nout = min((nin - 1) // q + 1, npts)
+    # One row per kept sample, each a view of the taps-long input window
+    windows = as_strided(padded, shape=(nout, len(taps)),
+                         strides=(q * padded.strides[0], padded.strides[0]))
+    out = windows.dot(taps[::-1])
+    if nout < npts:
+        out = numpy.append(out, numpy.repeat(out[-1], npts - nout))
+    return out
     
-def data2obspy(dates, data, name):
+def data2obspy(dates, data, name, verify=True):
     """
     Converts data to an obspy stream object.
     
@@ -978,6 +3196,8 @@ def data2obspy(dates, data, name):
         list is assumed to be continuous and evenly sampled.
     name: string
         Channel name separated by $ in station$channel$network order
+    verify: boolean
+        If true, run Trace.verify() on every trace.  default is True
         
     Outputs
     ---------
@@ -985,42 +3205,566 @@ def data2obspy(dates, data, name):
         Obspy stream, with each list converted to a trace with the appropriate
         metadata.
     """
-    from numpy import round,array
+    from numpy import round,asarray
     from obspy import Trace,Stream
-    streamData = Stream()
+    timer = stage('data2obspy')
     # Get ID
-    try:
-        sta,chan,net,loc = name.split('$',4)
-    except:
-        try:
-            sta, chan, net = name.split('$',3)
-            loc = ''
-        except:
-            try:
-                sta, chan = name.split('$',2)
-                net = ''
-                loc = ''
-            except:
-                sta = name
-                chan = ''
-                net = ''
-                loc = ''
-        
-        
+    sta, chan, net, loc = parseName(name)
+    traces = []
+    # Single sample segments take the delta of the first longer one
+    spacing = [round(d[1]-d[0]) for d in dates if len(d) > 1][:1] or [1.0]
     # Loop over lists to get metadata and convert to obspy
     for nowdates, nowdata in zip(dates, data):
         # Build metadata string, then punch the data into a Trace and save in the stream
         starttime = nowdates[0]
         npts = len(nowdata)
-        delta = round(nowdates[1]-nowdates[0])
+        delta = round(nowdates[1]-nowdates[0]) if npts > 1 else spacing[0]
         meta = {'station': sta, 'network': net, 'channel': chan, 'location': loc, 'delta': delta, 'starttime': starttime, 'npts': npts}
-        npdata = array(nowdata, dtype='float64')
+        npdata = asarray(nowdata, dtype='float64')
         T = Trace(data=npdata, header=meta)
-        T.verify()
-        streamData.append(T)
-    
-    return streamData
-    
+        if verify:
+            T.verify()
+        traces.append(T)
+    timer.done(records=sum(T.stats.npts for T in traces), nbytes=sum(T.data.nbytes for T in traces))
+    return Stream(traces=traces)
+
+def parseName(name):
+    """
+    Splits a $ separated station$channel$network$location name, filling in
+    missing parts with ''.
+
+    Outputs
+    ---------
+    sta, chan, net, loc: strings
+    """
+    parts = name.split('$')
+    if len(parts) > 4:
+        return name, '', '', ''
+    parts += [''] * (4 - len(parts))
+    return tuple(parts)
+
+def segments2obspy(segments, name, verify=False):
+    """
+    Converts (start, delta, data) segments, as returned by splitSegments, to
+    an obspy stream object.  float64 data arrays are used by the traces
+    as they are, without copying.
+
+    Parameters
+    ----------
+    segments: list
+        List of (start, delta, data) tuples.  start is epoch seconds (or a
+        UTCDateTime), delta is seconds per sample, data is an array.
+    name: string
+        Channel name separated by $ in station$channel$network order
+    verify: boolean
+        If true, run Trace.verify() on every trace.  default is False
+
+    Outputs
+    ---------
+    streamData: Stream
+        Obspy stream with one trace per segment.
+    """
+    from numpy import asarray
+    from obspy import Trace, Stream, UTCDateTime
+    timer = stage('segments2obspy')
+    sta, chan, net, loc = parseName(name)
+    traces = []
+    for start, delta, values in segments:
+        values = asarray(values, dtype='float64')
+        meta = {'station': sta, 'network': net, 'channel': chan, 'location': loc,
+                'delta': delta, 'starttime': UTCDateTime(start), 'npts': len(values)}
+        T = Trace(data=values, header=meta)
+        if verify:
+            T.verify()
+        traces.append(T)
+    timer.done(records=sum(T.stats.npts for T in traces))
+    return Stream(traces=traces)
+
+def sdsPath(root, name, day):
+    """
+    Returns the SDS archive path (root/YEAR/NET/STA/CHAN.D/
+    NET.STA.LOC.CHAN.D.YEAR.DOY) of one day of a $ separated channel name.
+    """
+    import os
+    sta, chan, net, loc = parseName(name)
+    year = day.strftime('%Y')
+    filename = '%s.%s.%s.%s.D.%s.%s' % (net, sta, loc, chan, year, day.strftime('%j'))
+    return os.path.join(root, year, net, sta, '%s.D' % chan, filename)
+
+# 3 character SEED channel codes for the archive names of each dataset's
+# series (the whole dataset for rsam, triggers and gps)
+seriesCodes = {'rsam': 'RSM', 'triggers': 'TRG', 'gps': 'LEN',
+               'tilt': {'radial': 'RAD', 'tangential': 'TAN', 'east': 'EAS',
+                        'north': 'NOR', 'rainfall': 'RAI'},
+               'flyspec': {'bstflux': 'BFX', 'bstfluxmean': 'BFM', 'bstfluxmeanstdev': 'BFS',
+                           'ps': 'PS', 'pd': 'PD'},
+               'strain': {'dt01': 'D01', 'dt02': 'D02', 'barometer': 'BAR'},
+               'rtnet': {'east': 'EAS', 'north': 'NOR', 'up': 'UP'}}
+
+def archiveName(dataset, channel, series, name=None, network='XX'):
+    """
+    Returns the $ separated station$channel$network$location name a channel
+    is archived under, checked against the SEED code lengths.  Without a
+    name, rsam and triggers channels (already station$channel$network) are
+    used as they are and other datasets get station$code, with code from
+    seriesCodes.  A missing channel code is taken from seriesCodes and a
+    missing network is set to network.  Raises ValueError for names that
+    can not be made valid.
+    """
+    if name is None:
+        if dataset in ('rsam', 'triggers'):
+            name = channel
+        else:
+            codes = seriesCodes[dataset]
+            code = codes if isinstance(codes, basestring) else codes.get(series)
+            if code is None:
+                raise ValueError('No SEED code for %s series %r, give a name for it' % (dataset, series))
+            name = '%s$%s' % (channel, code)
+    sta, chan, net, loc = parseName(name)
+    if not chan and isinstance(seriesCodes.get(dataset), basestring):
+        chan = seriesCodes[dataset]
+    net = net or network
+    if not 1 <= len(sta) <= 5 or not 1 <= len(chan) <= 3 or not 1 <= len(net) <= 2 or len(loc) > 2:
+        raise ValueError('%r is not a valid station$channel$network$location name (station up to 5, '
+                         'channel up to 3, network 1 or 2 and location up to 2 characters)' % name)
+    return '$'.join([sta, chan, net, loc]).rstrip('$')
+
+def archiveDay(spec, day, root, gapThres, delta, kernel, settle):
+    """
+    Fetches one day of one channel and writes it to the SDS archive.
+    Returns 'skipped', 'unchanged', 'empty' or 'written'.  See
+    archiveMiniSEED for the parameters.
+    """
+    import os
+    import calendar
+    import hashlib
+    from datetime import timedelta
+    dataset, channel, series, options, name = spec
+    path = sdsPath(root, name, day)
+    dayStart = calendar.timegm(day.timetuple())
+    dayEnd = dayStart + 86400
+    # A file written once the day had settled is complete
+    if os.path.exists(path) and os.path.getmtime(path) > dayEnd + settle:
+        return 'skipped'
+    fetchOptions = dict(options or {}, fast=True)
+    epoch, datenum, data = fetchSpec((dataset, channel, series, day.strftime('%Y%m%d%H%M%S'),
+                                      (day + timedelta(days=1)).strftime('%Y%m%d%H%M%S'),
+                                      fetchOptions))
+    keep = (epoch >= dayStart) & (epoch < dayEnd)
+    epoch, data = epoch[keep], data[keep]
+    if len(epoch) < 2:
+        return 'empty'
+    digest = hashlib.md5(epoch.tostring() + data.tostring()).hexdigest()
+    # hidden, so SDS readers globbing the archive do not pick them up
+    digestPath = os.path.join(os.path.dirname(path), '.%s.md5' % os.path.basename(path))
+    if os.path.exists(path) and os.path.exists(digestPath):
+        with open(digestPath) as f:
+            if f.read().strip() == digest:
+                os.utime(path, None)
+                return 'unchanged'
+    gapIndex = findGaps(epoch, gapThres, level=logging.DEBUG)['index']
+    segments = splitSegments(epoch, data, gapIndex, delta or 60, delta is not None, kernel)
+    if not segments:
+        return 'empty'
+    stream = segments2obspy(segments, name)
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            pass
+    tmp = os.path.join(folder, '.%s.tmp' % os.path.basename(path))
+    stream.write(tmp, format='MSEED')
+    os.rename(tmp, path)
+    with open(digestPath, 'w') as f:
+        f.write(digest)
+    return 'written'
+
+def archiveChannel(args):
+    """
+    Archives every day of one channel in order (see archiveMiniSEED).
+    Returns (name, counts, errors).
+    """
+    spec, days, root, gapThres, delta, kernel, settle = args
+    counts = {}
+    errors = []
+    for day in days:
+        try:
+            status = archiveDay(spec, day, root, gapThres, delta, kernel, settle)
+        except Exception as e:
+            status = 'error'
+            errors.append((day.strftime('%Y-%m-%d'), repr(e)))
+            logger.warning('Archiving %s for %s failed: %r', spec[4], day.strftime('%Y-%m-%d'), e)
+        counts[status] = counts.get(status, 0) + 1
+    return spec[4], counts, errors
+
+def archiveWorkerInit(options):
+    # Sockets must not be shared with the parent process
+    global client
+    client = ValveClient(**options)
+
+def archiveMiniSEED(channels, starttime, endtime, root, processes=4, gapThres=120,
+                    delta=None, kernel='linear', settle=86400, network='XX'):
+    """
+    Writes day files of many channels into an SDS style MiniSEED archive.
+    Channels are spread over worker processes and each worker goes through
+    its channel one day at a time, so only one day per worker is in memory.
+    Days already archived are skipped: a file written more than settle
+    seconds after its day ended is not fetched again, and other files are
+    only rewritten when the fetched samples changed.
+
+    Parameters
+    ----------
+    channels: list
+        list of (dataset, channel, series, options) or (dataset, channel,
+        series, options, name) tuples, as in a fetchMany spec.  name is the
+        $ separated station$channel$network$location used for the archive
+        (see archiveName); it defaults to channel for rsam and triggers and
+        to channel$code otherwise, with code the 3 character SEED code of
+        the series in seriesCodes.
+    starttime: string
+        first day to archive, yyyyMMdd
+    endtime: string
+        last day to archive, yyyyMMdd (inclusive)
+    root: string
+        directory of the SDS archive
+    processes: int
+        number of worker processes.  default is 4
+    gapThres: float
+        Threshold in seconds over which to detect a gap.  default is 120
+    delta: float
+        If given, resample to delta seconds per sample with kernel (see
+        resampleSegment).  default is None (write the samples as they are)
+    kernel: string
+        Resampling kernel.  default is 'linear'
+    settle: float
+        seconds after the end of a day after which its archive file is
+        considered final.  default is one day
+    network: string
+        network code for names without one.  default is 'XX'
+
+    Outputs
+    ---------
+    summary: dict
+        (counts, errors) for each channel name.  counts holds the number of
+        days 'written', 'unchanged', 'skipped', 'empty' and 'error'; errors
+        is a list of (day, error) pairs.
+    """
+    from datetime import timedelta
+    from multiprocessing import Pool
+    first = parseVtime(str(starttime)[:8])
+    last = parseVtime(str(endtime)[:8])
+    days = []
+    day = first
+    while day <= last:
+        days.append(day)
+        day += timedelta(days=1)
+    tasks = []
+    for spec in channels:
+        dataset, channel, series, options = spec[:4]
+        name = archiveName(dataset, channel, series, spec[4] if len(spec) > 4 else None, network)
+        tasks.append(((dataset, channel, series, options, name), days, root,
+                      gapThres, delta, kernel, settle))
+    summary = {}
+    if not tasks:
+        return summary
+    pool = Pool(min(processes, len(tasks)), archiveWorkerInit, (client.options(),))
+    try:
+        for name, counts, errors in pool.imap_unordered(archiveChannel, tasks):
+            logger.info('Archived %s: %s', name, counts)
+            summary[name] = (counts, errors)
+    finally:
+        pool.close()
+        pool.join()
+    return summary
+
+def epochValue(t):
+    """
+    Returns epoch seconds for a valve time string, a UTCDateTime/datetime or
+    a number (already epoch seconds), or None for None.
+    """
+    import calendar
+    if t is None:
+        return None
+    if isinstance(t, basestring):
+        parsed = parseVtime(t)
+        if parsed is None:
+            raise ValueError('Expected an absolute valve time, got %r' % t)
+        return float(calendar.timegm(parsed.timetuple()))
+    if hasattr(t, 'timetuple'):
+        return calendar.timegm(t.timetuple()) + getattr(t, 'microsecond', 0) / 1e6
+    return float(getattr(t, 'timestamp', t))
+
+class ColumnStore(object):
+    """
+    Local columnar store of fetched series.  Each dataset is partitioned by
+    channel, series and day into root/dataset/channel/series/yyyymmdd/
+    holding two uncompressed .npy columns, time (epoch seconds) and data,
+    so reads can memory map them.  A read only opens the day partitions
+    that overlap the requested time range and binary searches inside them.
+
+    Only one process should append to a store at a time.
+
+    Parameters
+    ----------
+    root: string
+        directory of the store
+
+    Example
+    ---------
+    store = ColumnStore('/data/valve')
+    store.fetch('rsam', 'NPT$HWZ$HV', None, '20150101', '20160101')
+    epoch, datenum, data = store.read('rsam', 'NPT$HWZ$HV', None, '20150601', '20150701')
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def directory(self, dataset, channel, series):
+        import os
+        from urllib import quote
+        return os.path.join(self.root, dataset, quote(channel, safe=''),
+                            quote(str(seriesKey(dataset, series)), safe=''))
+
+    def days(self, dataset, channel, series):
+        """
+        Returns the sorted day partitions (yyyymmdd) of a series.
+        """
+        import os
+        folder = self.directory(dataset, channel, series)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(d for d in os.listdir(folder) if len(d) == 8 and d.isdigit())
+
+    def loadDay(self, folder, mmap=True):
+        import os
+        import numpy
+        mode = 'r' if mmap else None
+        return (numpy.load(os.path.join(folder, 'time.npy'), mmap_mode=mode),
+                numpy.load(os.path.join(folder, 'data.npy'), mmap_mode=mode))
+
+    def append(self, dataset, channel, series, epoch, data):
+        """
+        Adds samples to the store, merging them into the existing day
+        partitions.  Samples at times already stored replace the old ones.
+        """
+        import os
+        import numpy
+        from datetime import datetime
+        epoch = numpy.asarray(epoch, dtype='float64')
+        data = numpy.asarray(data, dtype='float64')
+        if len(epoch) == 0:
+            return
+        folder = self.directory(dataset, channel, series)
+        dayNumber = numpy.floor(epoch / 86400.0).astype('int64')
+        splits = numpy.flatnonzero(numpy.diff(dayNumber)) + 1
+        for lo, hi in zip(numpy.concatenate(([0], splits)), numpy.concatenate((splits, [len(epoch)]))):
+            day = datetime.utcfromtimestamp(dayNumber[lo] * 86400).strftime('%Y%m%d')
+            partition = os.path.join(folder, day)
+            times, values = epoch[lo:hi], data[lo:hi]
+            if os.path.isdir(partition):
+                oldTimes, oldValues = self.loadDay(partition, mmap=False)
+                times = numpy.concatenate((times, oldTimes))
+                values = numpy.concatenate((values, oldValues))
+            else:
+                os.makedirs(partition)
+            # Keep the first (newest) sample at each time, in time order
+            times, first = numpy.unique(times, return_index=True)
+            values = values[first]
+            for column, array in (('time', times), ('data', values)):
+                tmp = os.path.join(partition, column + '.tmp.npy')
+                numpy.save(tmp, array)
+                os.rename(tmp, os.path.join(partition, column + '.npy'))
+
+    def fetch(self, dataset, channel, series, starttime, endtime, options=None):
+        """
+        Fetches a window from Valve (see fetchMany for the arguments) and
+        appends it to the store.  Returns the number of samples fetched.
+        """
+        epoch, datenum, data = fetchSpec((dataset, channel, series, starttime, endtime,
+                                          dict(options or {}, fast=True)))
+        self.append(dataset, channel, series, epoch, data)
+        return len(epoch)
+
+    def read(self, dataset, channel, series, starttime=None, endtime=None, mmap=True):
+        """
+        Reads the stored samples from starttime to endtime (inclusive).
+
+        Parameters
+        ----------
+        starttime, endtime: string, number or UTCDateTime
+            valve time strings (yyyy[MMdd[hhmm[ss]]]), epoch seconds or
+            UTCDateTime.  None reads from the first or to the last sample.
+        mmap: boolean
+            If true, partitions are memory mapped, and a range inside a
+            single day is returned as views of the mapped files
+
+        Outputs
+        ---------
+        Same as the get* functions with fast=True
+        """
+        import os
+        import numpy
+        from datetime import datetime
+        start = epochValue(starttime)
+        end = epochValue(endtime)
+        folder = self.directory(dataset, channel, series)
+        first = None if start is None else datetime.utcfromtimestamp(start).strftime('%Y%m%d')
+        last = None if end is None else datetime.utcfromtimestamp(end).strftime('%Y%m%d')
+        times = []
+        values = []
+        for day in self.days(dataset, channel, series):
+            if (first is not None and day < first) or (last is not None and day > last):
+                continue
+            t, d = self.loadDay(os.path.join(folder, day), mmap)
+            lo = 0 if start is None else numpy.searchsorted(t, start)
+            hi = len(t) if end is None else numpy.searchsorted(t, end, side='right')
+            times.append(t[lo:hi])
+            values.append(d[lo:hi])
+        if not times:
+            empty = numpy.zeros(0)
+            return empty, empty.copy(), empty.copy()
+        if len(times) == 1:
+            epoch, data = times[0], values[0]
+        else:
+            epoch, data = numpy.concatenate(times), numpy.concatenate(values)
+        return epoch, epoch2num(epoch), data
+
+class SeriesView(object):
+    """
+    Read-only view of a series in a ColumnStore, backed by numpy.memmap
+    over the stored time and data files.  Opening a view only reads the
+    file headers; slicing binary searches the mapped times, and the data,
+    datenums and gaps are only computed when they are asked for.  Unpacks
+    like the fast get* outputs:
+
+        epoch, datenum, data = openSeries('tilt', 'UWE', 'radial', store)
+
+    Use openSeries to make one.
+    """
+    def __init__(self, store, dataset, channel, series, starttime=None, endtime=None):
+        import os
+        import numpy
+        from datetime import datetime
+        self.store = store
+        self.dataset = dataset
+        self.channel = channel
+        self.series = series
+        start = epochValue(starttime)
+        end = epochValue(endtime)
+        first = None if start is None else datetime.utcfromtimestamp(start).strftime('%Y%m%d')
+        last = None if end is None else datetime.utcfromtimestamp(end).strftime('%Y%m%d')
+        folder = store.directory(dataset, channel, series)
+        self.parts = []
+        for day in store.days(dataset, channel, series):
+            if (first is not None and day < first) or (last is not None and day > last):
+                continue
+            t, d = store.loadDay(os.path.join(folder, day), mmap=True)
+            lo = 0 if start is None or day != first else numpy.searchsorted(t, start)
+            hi = len(t) if end is None or day != last else numpy.searchsorted(t, end, side='right')
+            if hi > lo:
+                self.parts.append((t[lo:hi], d[lo:hi]))
+        self.cached = {}
+
+    def __len__(self):
+        return sum(len(t) for t, d in self.parts)
+
+    def __iter__(self):
+        return iter((self.epoch, self.datenum, self.data))
+
+    def column(self, which):
+        import numpy
+        if which not in self.cached:
+            if not self.parts:
+                self.cached[which] = numpy.zeros(0)
+            elif len(self.parts) == 1:
+                self.cached[which] = self.parts[0][which]
+            else:
+                self.cached[which] = numpy.concatenate([p[which] for p in self.parts])
+        return self.cached[which]
+
+    @property
+    def epoch(self):
+        """Epoch seconds of the samples (a memmap view within one day)"""
+        return self.column(0)
+
+    @property
+    def data(self):
+        """Data of the samples (a memmap view within one day)"""
+        return self.column(1)
+
+    @property
+    def datenum(self):
+        """matplotlib datenums of the samples, computed on first use"""
+        if 'datenum' not in self.cached:
+            self.cached['datenum'] = epoch2num(self.epoch)
+        return self.cached['datenum']
+
+    @property
+    def date(self):
+        """UTCDateTime list of the samples, built on first use"""
+        if 'date' not in self.cached:
+            self.cached['date'] = epoch2utc(self.epoch)
+        return self.cached['date']
+
+    def gaps(self, gapThres):
+        """
+        findGaps of the view for gapThres seconds, computed once per
+        threshold.
+        """
+        key = ('gaps', gapThres)
+        if key not in self.cached:
+            self.cached[key] = findGaps(self.epoch, gapThres, level=logging.DEBUG)
+        return self.cached[key]
+
+    def slice(self, starttime=None, endtime=None):
+        """
+        Returns a new view from starttime to endtime (inclusive), given as
+        valve time strings, epoch seconds or UTCDateTime.
+        """
+        import numpy
+        start = epochValue(starttime)
+        end = epochValue(endtime)
+        view = SeriesView.__new__(SeriesView)
+        view.store = self.store
+        view.dataset = self.dataset
+        view.channel = self.channel
+        view.series = self.series
+        view.parts = []
+        view.cached = {}
+        for t, d in self.parts:
+            if len(t) == 0 or (start is not None and t[-1] < start) or (end is not None and t[0] > end):
+                continue
+            lo = 0 if start is None else numpy.searchsorted(t, start)
+            hi = len(t) if end is None else numpy.searchsorted(t, end, side='right')
+            if hi > lo:
+                view.parts.append((t[lo:hi], d[lo:hi]))
+        return view
+
+def openSeries(dataset, channel, series, store, starttime=None, endtime=None):
+    """
+    Opens a stored series as a memory mapped SeriesView.
+
+    Parameters
+    ----------
+    dataset: string
+        'rsam', 'triggers', 'tilt', 'flyspec', 'strain', 'gps' or 'rtnet'
+    channel: string
+        channel name
+    series: string
+        series name (None for rsam, triggers and gps)
+    store: ColumnStore or string
+        the store, or its root directory
+    starttime, endtime: string, number or UTCDateTime
+        optional range to open (see SeriesView.slice)
+
+    Outputs
+    ---------
+    series: SeriesView
+    """
+    if not isinstance(store, ColumnStore):
+        store = ColumnStore(store)
+    return SeriesView(store, dataset, channel, series, starttime, endtime)
+
 def vtime2obspytime( vtime ):
     """
     Converts valve time string to UTCdatetime (an obspy object).
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+valveFakeServer.py
+Local stand-in for the Valve REST interface, for load testing and
+benchmarking valveData without touching hvo-rest.wr.usgs.gov.  Serves
+synthetic /api/rsam, /api/triggers, /api/tilt, /api/flyspec, /api/strain,
+/api/gps and /api/rtnet responses in the same json layout as Valve, with
+configurable sample rates, gap density and latency.  A request without
+parameters gets a small info response, like rsaminfo().  format=csv gets a
+csv table instead of json, and responses are gzipped for clients that
+accept it.
+--------------------------------------------------------------------
+Example:
+import valveData, valveFakeServer
+server = valveFakeServer.FakeValveServer(gapRate=0.001, latency=0.05).start()
+valveData.configureClient(host=server.host)
+date, datenum, data = valveData.getRsamSpan('NPT$HWZ$HV', '201504150000', '201504160000')
+server.stop()
+
+or from the command line:
+python valveFakeServer.py --port 8765 --gapRate 0.001
+"""
+import json
+import time
+import threading
+import BaseHTTPServer
+import SocketServer
+
+# Nominal seconds per sample and record labels of each dataset
+intervals = {'rsam': 60, 'triggers': 60, 'tilt': 1, 'strain': 1,
+             'flyspec': 10, 'gps': 86400, 'rtnet': 1}
+labels = {'rsam': ['rsam'], 'triggers': ['triggers'], 'gps': ['length'],
+          'tilt': ['radial', 'tangential', 'east', 'north', 'rainfall'],
+          'flyspec': ['bstflux', 'bstfluxmean', 'bstfluxmeanstdev', 'ps', 'pd'],
+          'strain': ['dt01', 'dt02', 'barometer'],
+          'rtnet': ['east', 'north', 'up']}
+# Seconds in each unit of a relative valve time (ex. '-12h')
+relativeUnits = {'i': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400,
+                 'm': 30 * 86400, 'y': 365 * 86400}
+vtimeFormats = {4: '%Y', 6: '%Y%m', 8: '%Y%m%d', 10: '%Y%m%d%H',
+                12: '%Y%m%d%H%M', 14: '%Y%m%d%H%M%S'}
+
+def parseTime(vtime, end=None):
+    '''
+    Returns epoch seconds for a valve time string.  Relative times (ex.
+    '-12h') are taken back from end (default now).
+    '''
+    import calendar
+    from datetime import datetime
+    vtime = str(vtime)
+    unit = vtime.lstrip('-')
+    if unit[:-1].isdigit() and unit[-1:] in relativeUnits:
+        return (time.time() if end is None else end) - int(unit[:-1]) * relativeUnits[unit[-1]]
+    return calendar.timegm(datetime.strptime(vtime, vtimeFormats[len(vtime)]).timetuple())
+
+def makeSamples(dataset, channel, columns, start, end, interval, gapRate=0.0, gapLength=600, seed=0):
+    '''
+    Returns (epoch, data) arrays of synthetic samples on a fixed grid of
+    interval seconds from start to end.  Each sample starts a gap of
+    gapLength seconds with probability gapRate, including samples up to
+    gapLength before start.  The samples of a channel are the same for the
+    same seed, whatever window is asked for.
+
+    Parameters
+    ----------
+    dataset, channel: string
+        what is being asked for (used to vary the values)
+    columns: list
+        series labels, one data column each
+    start, end: float
+        epoch seconds of the window (inclusive)
+    interval: float
+        seconds per sample
+    gapRate: float
+        chance of each sample starting a gap.  default is 0
+    gapLength: float
+        seconds each gap lasts.  default is 600
+    seed: int
+        random seed.  default is 0
+
+    Outputs
+    ---------
+    epoch: numpy array
+        epoch seconds of the samples
+    data: numpy array
+        one row per sample, one column per series
+    '''
+    import zlib
+    import numpy
+    span = int(max(gapLength // interval, 1)) if gapRate > 0 else 0
+    # start the grid a gap early, so gaps running into the window are kept
+    first = numpy.ceil(start / interval)
+    epoch = numpy.arange(first - span, numpy.floor(end / interval) + 1) * interval
+    n = len(epoch)
+    key = zlib.crc32('%s$%s' % (dataset, channel)) & 0xffffffff
+    # gap starts depend only on the sample time, so windows agree
+    rand = (numpy.sin(epoch * 12.9898 + key + seed * 78.233) * 43758.5453) % 1.0
+    keep = numpy.arange(n) >= span
+    if span and n:
+        starts = numpy.flatnonzero(rand < gapRate)
+        drop = numpy.zeros(n + 1, dtype='int64')
+        numpy.add.at(drop, starts, 1)
+        numpy.add.at(drop, numpy.minimum(starts + span, n), -1)
+        keep &= numpy.cumsum(drop)[:n] == 0
+    epoch, rand = epoch[keep], rand[keep]
+    data = numpy.empty((len(epoch), len(columns)))
+    for i in range(len(columns)):
+        data[:, i] = 100 * numpy.sin(epoch / 86400.0 + i + key % 97) + rand
+    return epoch, data
+
+def renderCsv(columns, epoch, data):
+    '''
+    Returns a csv table of the samples: a header line, then the date and
+    the data of each sample.
+    '''
+    import numpy
+    dates = numpy.datetime_as_string(epoch.astype('int64').astype('datetime64[s]').astype('datetime64[ms]'))
+    template = '%s' + ',%r' * len(columns)
+    rows = [template % ((d.replace('T', ' '),) + tuple(v)) for d, v in zip(dates, data.tolist())]
+    return '\n'.join(['date,' + ','.join(columns)] + rows) + '\n'
+
+def renderJson(channel, columns, epoch, data):
+    '''
+    Returns the Valve json response for the samples.
+    '''
+    import numpy
+    dates = numpy.datetime_as_string(epoch.astype('int64').astype('datetime64[s]').astype('datetime64[ms]'))
+    fields = ''.join(', "%s": %%r' % c for c in columns)
+    template = '{"date": "%s"' + fields + '}'
+    rows = [template % ((d.replace('T', ' '),) + tuple(v)) for d, v in zip(dates, data.tolist())]
+    return '{"records": {%s: [%s]}}' % (json.dumps(channel), ', '.join(rows))
+
+class FakeValveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        import urlparse
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        dataset = url.path.rstrip('/').rsplit('/', 1)[-1]
+        query = dict(urlparse.parse_qsl(url.query))
+        server.count(dataset)
+        if server.latency:
+            time.sleep(server.latency)
+        if dataset not in intervals:
+            return self.reply(404, json.dumps({'error': 'unknown dataset %s' % dataset}))
+        if 'channel' not in query:
+            return self.reply(200, json.dumps(server.info(dataset)))
+        try:
+            body = server.response(dataset, query)
+        except (KeyError, ValueError) as e:
+            return self.reply(400, json.dumps({'error': str(e)}))
+        csv = server.csv and query.get('format') == 'csv'
+        self.reply(200, body, 'text/csv' if csv else 'application/json')
+
+    def reply(self, status, body, contentType='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        if self.server.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            import gzip
+            from StringIO import StringIO
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as f:
+                f.write(body)
+            body = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class FakeValveServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    Threaded fake Valve server.
+
+    Parameters
+    ----------
+    port: int
+        port to listen on.  default is 0 (any free port, see host)
+    gapRate: float
+        chance of each sample starting a gap.  default is 0.001
+    gapLength: float
+        seconds each gap lasts.  default is 600
+    latency: float
+        seconds each request waits before answering.  default is 0
+    rate: float
+        samples per nominal sample of each dataset (ex. 10 serves rsam at
+        6 seconds per sample), to scale response sizes.  default is 1
+    maxSamples: int
+        largest response in samples, larger ones get a 400.  default is
+        10000000
+    channels: list
+        channel codes listed by the info responses.  Any channel can be
+        fetched.  default is ['FAKE']
+    seed: int
+        random seed of the synthetic data.  default is 0
+    compress: boolean
+        gzip responses for clients that accept it.  default is True
+    csv: boolean
+        answer format=csv with a csv table.  default is True
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, gapRate=0.001, gapLength=600, latency=0, rate=1,
+                 maxSamples=10000000, channels=None, seed=0, compress=True, csv=True):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), FakeValveHandler)
+        self.gapRate = gapRate
+        self.gapLength = gapLength
+        self.latency = latency
+        self.rate = rate
+        self.maxSamples = maxSamples
+        self.channels = channels or ['FAKE']
+        self.seed = seed
+        self.compress = compress
+        self.csv = csv
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def host(self):
+        '''host:port to hand to valveData.configureClient'''
+        return '127.0.0.1:%d' % self.server_address[1]
+
+    def count(self, dataset):
+        with self.lock:
+            self.requests[dataset] = self.requests.get(dataset, 0) + 1
+
+    def info(self, dataset):
+        return {'channels': [{'code': c, 'name': c, 'interval': intervals[dataset] / float(self.rate)}
+                             for c in self.channels],
+                'series': labels[dataset],
+                'ranks': {'1': 'Raw Data', '2': 'Best Possible'}}
+
+    def response(self, dataset, query):
+        end = parseTime(query['endtime']) if 'endtime' in query else time.time()
+        start = parseTime(query['starttime'], end)
+        interval = intervals[dataset] / float(self.rate)
+        if query.get('downsample', 'none') != 'none' or dataset == 'gps':
+            interval *= int(query.get('dsint', 1))
+        columns = labels[dataset] if len(labels[dataset]) == 1 else query.get('series', labels[dataset][0]).split(',')
+        for c in columns:
+            if c not in labels[dataset]:
+                raise KeyError('unknown series %s' % c)
+        if (end - start) / interval > self.maxSamples:
+            raise ValueError('more than %d samples requested' % self.maxSamples)
+        epoch, data = makeSamples(dataset, query['channel'], columns, start, end, interval,
+                                  self.gapRate, self.gapLength, self.seed)
+        if self.csv and query.get('format') == 'csv':
+            return renderCsv(columns, epoch, data)
+        return renderJson(query['channel'], columns, epoch, data)
+
+    def start(self):
+        '''Serves requests from a background thread.  Returns the server.'''
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Fake Valve REST server')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--gapRate', type=float, default=0.001)
+    parser.add_argument('--gapLength', type=float, default=600)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--rate', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--noCompress', action='store_true')
+    parser.add_argument('--noCsv', action='store_true')
+    args = parser.parse_args()
+    server = FakeValveServer(args.port, args.gapRate, args.gapLength, args.latency,
+                             args.rate, seed=args.seed, compress=not args.noCompress,
+                             csv=not args.noCsv)
+    print 'Serving fake Valve on http://%s/api/' % server.host
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()